@@ -0,0 +1,93 @@
+"""
+Move notifications older than N days out of the hot `notifications`
+collection into `notifications_archive`.
+
+Read notifications are already removed by the TTL index on read_at; this
+catches the rest (unread ones, and ones read before read_at existed).
+Run it periodically, e.g. from cron:
+
+    python archive_notifications.py --days 180
+
+The API caches unread counters in process for
+NOTIFICATION_COUNTER_CACHE_TTL_SECONDS (30 s by default), so badges of
+recipients with archived unread notifications catch up once that expires,
+or at once after POST /api/admin/notification-counters/rebuild.
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MONGO_URI = os.environ.get('MONGO_URL') or os.environ.get('MONGO_URI')
+if not MONGO_URI:
+    print("MONGO_URL not found in environment variables")
+    exit(1)
+
+client = AsyncIOMotorClient(MONGO_URI)
+db = client[os.environ.get('DB_NAME', 'pettrust_bogota')]
+
+BATCH_SIZE = 1000
+
+
+async def archive_notifications(days: int):
+    """Copy each batch to the archive before deleting it from the hot
+    collection, so an interrupted run loses nothing; re-running skips
+    notifications already archived."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    await db.notifications_archive.create_index("id", unique=True)
+    await db.notifications_archive.create_index([("user_id", 1), ("created_at", -1)])
+
+    archived = 0
+    while True:
+        batch = await db.notifications.find(
+            {"created_at": {"$lt": cutoff}}, {"_id": 0}
+        ).sort("created_at", 1).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not batch:
+            break
+
+        archived_at = datetime.now(timezone.utc)
+        await db.notifications_archive.bulk_write([
+            UpdateOne({"id": n["id"]}, {"$setOnInsert": {**n, "archived_at": archived_at}}, upsert=True)
+            for n in batch
+        ], ordered=False)
+        # Notifications only go from unread to read, and marking one read
+        # already decrements its counter: unread ones are deleted only while
+        # still unread, and any read since the batch was fetched are deleted
+        # without decrementing again
+        ids = [n["id"] for n in batch]
+        unread_ids = {n["id"] for n in batch if not n.get("read")}
+        await db.notifications.delete_many({"id": {"$in": list(unread_ids)}, "read": False})
+        read_since = {n["id"] async for n in db.notifications.find({"id": {"$in": list(unread_ids)}}, {"_id": 0, "id": 1})}
+        await db.notifications.delete_many({"id": {"$in": ids}})
+
+        # Archived unread notifications no longer count towards the badge
+        unread = {}
+        for n in batch:
+            if n["id"] in unread_ids and n["id"] not in read_since:
+                unread[n["user_id"]] = unread.get(n["user_id"], 0) + 1
+        if unread:
+            await db.notification_counters.bulk_write([
+                UpdateOne({"recipient_id": user_id}, {"$inc": {"unread": -count, "version": 1}})
+                for user_id, count in unread.items()
+            ], ordered=False)
+
+        archived += len(batch)
+        print(f"  archived {archived} notifications...")
+
+    print(f"Archived {archived} notifications created before {cutoff}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=180, help="archive notifications older than this")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(archive_notifications(args.days))
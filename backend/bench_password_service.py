@@ -0,0 +1,117 @@
+"""
+Benchmark: bcrypt on the event loop vs. PasswordService thread pool.
+
+Fires a burst of concurrent logins while a steady stream of cheap requests
+(standing in for GPS updates and chat polls) hits the same app, and reports
+login throughput plus p50/p99 latency of the cheap requests.
+
+Runs in-process against small FastAPI apps that reuse the server's password
+helpers, so no MongoDB is needed:
+
+    python bench_password_service.py --logins 40 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "pettrust_bench")
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+import server
+
+PASSWORD = "bench-password-123"
+
+
+def build_app(password_hash: str, use_service: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/login")
+    async def login():
+        if use_service:
+            ok = await server.password_service.verify(PASSWORD, password_hash)
+        else:
+            ok = server.verify_password(PASSWORD, password_hash)
+        if not ok:
+            raise HTTPException(status_code=401)
+        return {"ok": True}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def run_mode(password_hash: str, use_service: bool, logins: int, ping_interval: float):
+    app = build_app(password_hash, use_service)
+    transport = httpx.ASGITransport(app=app)
+    ping_latencies = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        done = asyncio.Event()
+
+        async def pinger():
+            # Latency is measured from when each ping was due, so time spent
+            # waiting for a blocked event loop counts against it
+            due = time.perf_counter()
+            while not done.is_set():
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await http.get("/ping")
+                ping_latencies.append((time.perf_counter() - due) * 1000)
+                due = max(due + ping_interval, time.perf_counter())
+
+        ping_task = asyncio.create_task(pinger())
+        await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[http.post("/login") for _ in range(logins)])
+        elapsed = time.perf_counter() - started
+
+        done.set()
+        await ping_task
+
+    assert all(r.status_code == 200 for r in responses)
+    return {
+        "mode": "thread pool" if use_service else "inline",
+        "logins_per_s": logins / elapsed,
+        "elapsed_s": elapsed,
+        "ping_count": len(ping_latencies),
+        "ping_p50_ms": percentile(ping_latencies, 0.50),
+        "ping_p99_ms": percentile(ping_latencies, 0.99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40, help="concurrent logins in the burst")
+    parser.add_argument("--workers", type=int, default=4, help="PasswordService thread pool size")
+    parser.add_argument("--ping-interval", type=float, default=0.005, help="seconds between cheap requests")
+    args = parser.parse_args()
+
+    server.password_service = server.PasswordService(max_workers=args.workers, max_queue=args.logins * 2)
+    password_hash = server.hash_password(PASSWORD)
+
+    print(f"{args.logins} concurrent logins, {args.workers} bcrypt workers\n")
+    print(f"{'mode':<12} {'logins/s':>9} {'total s':>8} {'pings':>6} {'ping p50 ms':>12} {'ping p99 ms':>12}")
+    for use_service in (False, True):
+        r = await run_mode(password_hash, use_service, args.logins, args.ping_interval)
+        print(f"{r['mode']:<12} {r['logins_per_s']:>9.1f} {r['elapsed_s']:>8.2f} {r['ping_count']:>6} "
+              f"{r['ping_p50_ms']:>12.1f} {r['ping_p99_ms']:>12.1f}")
+
+    print("\npassword_service:", server.password_service.stats())
+    server.password_service.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
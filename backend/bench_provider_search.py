@@ -0,0 +1,123 @@
+"""
+Benchmark: slot occupancy for /providers/search, per-provider count_documents
+vs. count_active_bookings, which reads the materialized slot_occupancy
+counters.
+
+Seeds a scratch database with N walkers and random bookings, then measures
+round trips (via pymongo command monitoring) and wall time for both
+strategies. Needs a MongoDB reachable at MONGO_URL; the scratch database is
+dropped afterwards.
+
+    MONGO_URL=mongodb://localhost:27017 python bench_provider_search.py --providers 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+
+from pymongo import monitoring
+from motor.motor_asyncio import AsyncIOMotorClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "pettrust_bench")
+
+import server
+
+BENCH_DB = "pettrust_bench_search"
+DATE = "2026-03-02"
+SLOTS = ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00", "17:00"]
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name in ("aggregate", "count", "find", "getMore"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def seed(db, providers: int):
+    walkers = [{"id": str(uuid.uuid4()), "capacity_max": 4} for _ in range(providers)]
+    bookings = []
+    for walker in walkers:
+        for _ in range(random.randint(0, 6)):
+            bookings.append({
+                "id": str(uuid.uuid4()),
+                "service_id": walker["id"],
+                "date": DATE,
+                "time": random.choice(SLOTS),
+                "status": random.choice(server.ACTIVE_BOOKING_STATUSES + ["completed", "cancelled"])
+            })
+    await db.bookings.insert_many(bookings)
+    await db.bookings.create_index([("service_id", 1), ("date", 1), ("time", 1)])
+    await db.slot_occupancy.create_index([("service_id", 1), ("date", 1), ("time", 1)], unique=True)
+    await server.rebuild_slot_occupancy()
+    return [w["id"] for w in walkers], len(bookings)
+
+
+async def per_provider_counts(db, service_ids, slot):
+    """The loop search_providers used to run"""
+    counts = {}
+    for service_id in service_ids:
+        counts[service_id] = await db.bookings.count_documents({
+            "service_id": service_id,
+            "date": DATE,
+            "time": slot,
+            "status": {"$in": ["pending", "confirmed", "in_progress"]}
+        })
+    return counts
+
+
+async def measure(counter, fn, rounds):
+    counter.count = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = await fn()
+    elapsed_ms = (time.perf_counter() - started) * 1000 / rounds
+    return result, counter.count // rounds, elapsed_ms
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], event_listeners=[counter])
+    db = client[BENCH_DB]
+    server.db = db
+    await client.drop_database(BENCH_DB)
+
+    try:
+        service_ids, booking_count = await seed(db, args.providers)
+        print(f"{args.providers} providers, {booking_count} bookings on {DATE}\n")
+
+        slot = SLOTS[0]
+        before, before_queries, before_ms = await measure(
+            counter, lambda: per_provider_counts(db, service_ids, slot), args.rounds
+        )
+        after, after_queries, after_ms = await measure(
+            counter, lambda: server.count_active_bookings(service_ids, DATE, slot, by_slot=True), args.rounds
+        )
+        assert {k: v for k, v in before.items() if v} == after, "strategies disagree"
+
+        print(f"{'strategy':<28} {'queries':>8} {'latency ms':>11}")
+        print(f"{'count_documents per provider':<28} {before_queries:>8} {before_ms:>11.1f}")
+        print(f"{'slot_occupancy point read':<28} {after_queries:>8} {after_ms:>11.1f}")
+    finally:
+        await client.drop_database(BENCH_DB)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
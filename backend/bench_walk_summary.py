@@ -0,0 +1,94 @@
+"""
+Benchmark: walk summary on long trails.
+
+Builds a synthetic trail (a walker moving at ~1.3 m/s with GPS jitter, a
+share of single-fix jumps and low-accuracy fixes) and times summarize_walk
+against a per-fix Python filter measuring each fix from the last plausible
+one, which is what plausible_fix_mask computes. Checks both keep the same
+fixes.
+
+Pure computation, so no MongoDB is needed:
+
+    python bench_walk_summary.py --fixes 5000 --jump-rate 0.005
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "pettrust_bench")
+
+import server
+
+
+def build_trail(fixes: int, jump_rate: float, seed: int):
+    rng = random.Random(seed)
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    lat, lng = 4.6951, -74.0621
+    points = []
+    for i in range(fixes):
+        lat += rng.gauss(6e-5, 2e-5)
+        lng += rng.gauss(0, 2e-5)
+        point_lat = lat + (rng.uniform(-0.03, 0.03) if rng.random() < jump_rate else 0.0)
+        points.append({
+            "lat": point_lat,
+            "lng": lng,
+            "accuracy": 120.0 if rng.random() < 0.02 else rng.uniform(3, 15),
+            "speed": None,
+            "timestamp": (started + timedelta(seconds=5 * i)).isoformat()
+        })
+    return points
+
+
+def loop_filter(points):
+    kept = []
+    last_t = 0.0
+    for point in points:
+        accuracy = point.get("accuracy")
+        if accuracy is not None and accuracy > server.SUMMARY_MAX_ACCURACY_M:
+            continue
+        t = datetime.fromisoformat(point["timestamp"]).timestamp()
+        if kept:
+            elapsed = t - last_t
+            if elapsed <= 0:
+                continue
+            moved = float(server.haversine_m(kept[-1]["lat"], kept[-1]["lng"], point["lat"], point["lng"]))
+            if moved > server.JUMP_MIN_DISTANCE_M and moved / elapsed > server.MAX_PLAUSIBLE_SPEED_MPS:
+                continue
+        kept.append(point)
+        last_t = t
+    return kept
+
+
+def best_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixes", type=int, default=5000, help="fixes in the trail")
+    parser.add_argument("--jump-rate", type=float, default=0.005, help="share of fixes that are GPS jumps")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement (best is reported)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    points = build_trail(args.fixes, args.jump_rate, args.seed)
+    summary = server.summarize_walk(points)
+    assert summary["point_count"] - summary["dropped_point_count"] == len(loop_filter(points))
+
+    print(f"{args.fixes} fixes, jump rate {args.jump_rate}, {summary['dropped_point_count']} dropped\n")
+    print(f"{'step':<28} {'best ms':>8}")
+    print(f"{'per-fix loop filter only':<28} {best_ms(lambda: loop_filter(points), args.repeat):>8.1f}")
+    print(f"{'summarize_walk (full)':<28} {best_ms(lambda: server.summarize_walk(points), args.repeat):>8.1f}")
+    print("\nsummary:", {k: v for k, v in summary.items() if k != "bbox"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import CollectionInvalid
+from dotenv import load_dotenv
+
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MONGO_URI = os.environ.get('MONGO_URL') or os.environ.get('MONGO_URI')
+if not MONGO_URI:
+    print("MONGO_URL not found in environment variables")
+    exit(1)
+
+client = AsyncIOMotorClient(MONGO_URI)
+db = client[os.environ.get('DB_NAME', 'pettrust_bogota')]
+
+
+def parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    ts = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+async def migrate_location_history():
+    """Move bookings.location_history arrays into the location_fixes
+    time-series collection, then drop the arrays from the bookings.
+
+    Safe to re-run: a booking's fixes are replaced before being inserted,
+    and a booking only loses its array after its fixes are written."""
+    print("Ensuring location_fixes time-series collection...")
+    try:
+        await db.create_collection(
+            "location_fixes",
+            timeseries={"timeField": "ts", "metaField": "booking_id", "granularity": "seconds"}
+        )
+    except CollectionInvalid:
+        pass
+    await db.location_fixes.create_index([("booking_id", 1), ("ts", 1)])
+
+    migrated_bookings = 0
+    migrated_fixes = 0
+    cursor = db.bookings.find(
+        {"location_history.0": {"$exists": True}},
+        {"_id": 0, "id": 1, "location_history": 1}
+    )
+    async for booking in cursor:
+        fixes = []
+        for entry in booking["location_history"]:
+            if entry.get("lat") is None or entry.get("lng") is None or not entry.get("timestamp"):
+                continue
+            fixes.append({
+                "booking_id": booking["id"],
+                "ts": parse_timestamp(entry["timestamp"]),
+                "lat": entry["lat"],
+                "lng": entry["lng"],
+                "accuracy": entry.get("accuracy"),
+                "speed": entry.get("speed")
+            })
+
+        await db.location_fixes.delete_many({"booking_id": booking["id"]})
+        if fixes:
+            await db.location_fixes.insert_many(fixes, ordered=False)
+        await db.bookings.update_one({"id": booking["id"]}, {"$unset": {"location_history": ""}})
+
+        migrated_bookings += 1
+        migrated_fixes += len(fixes)
+        print(f"  {booking['id']}: {len(fixes)} fixes")
+
+    # Bookings that only carried an empty array
+    result = await db.bookings.update_many(
+        {"location_history": {"$exists": True}},
+        {"$unset": {"location_history": ""}}
+    )
+
+    print(f"Migrated {migrated_fixes} fixes from {migrated_bookings} bookings "
+          f"({result.modified_count} empty arrays removed)")
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(migrate_location_history())
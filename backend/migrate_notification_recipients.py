@@ -0,0 +1,73 @@
+import asyncio
+import os
+import uuid
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MONGO_URI = os.environ.get('MONGO_URL') or os.environ.get('MONGO_URI')
+if not MONGO_URI:
+    print("MONGO_URL not found in environment variables")
+    exit(1)
+
+client = AsyncIOMotorClient(MONGO_URI)
+db = client[os.environ.get('DB_NAME', 'pettrust_bogota')]
+
+PROVIDER_COLLECTIONS = ["walkers", "daycares", "vets"]
+ROLE_TARGETS = ["admin"]
+
+
+async def migrate_notification_recipients():
+    """Re-address notifications stored under a provider profile id or a
+    role name ("admin") to the user ids that read them, then recompute the
+    unread counters.
+
+    Safe to re-run: once re-addressed, a notification no longer matches
+    any profile id or role name."""
+    profile_users = {}
+    for collection in PROVIDER_COLLECTIONS:
+        async for profile in db[collection].find({}, {"_id": 0, "id": 1, "user_id": 1}):
+            if profile.get("user_id"):
+                profile_users[profile["id"]] = profile["user_id"]
+
+    readdressed = 0
+    for profile_id, user_id in profile_users.items():
+        result = await db.notifications.update_many({"user_id": profile_id}, {"$set": {"user_id": user_id}})
+        readdressed += result.modified_count
+    print(f"Re-addressed {readdressed} provider profile notifications")
+
+    for role in ROLE_TARGETS:
+        members = [u["id"] async for u in db.users.find({"role": role}, {"_id": 0, "id": 1})]
+        fanned_out = 0
+        async for notification in db.notifications.find({"user_id": role}, {"_id": 0}):
+            copies = [
+                {**notification, "id": str(uuid.uuid4()), "user_id": member_id}
+                for member_id in members
+            ]
+            if copies:
+                await db.notifications.insert_many(copies, ordered=False)
+            await db.notifications.delete_one({"id": notification["id"]})
+            fanned_out += 1
+        print(f"Fanned out {fanned_out} '{role}' notifications to {len(members)} users")
+
+    print("Recomputing notification counters...")
+    rows = await db.notifications.aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ]).to_list(None)
+    if rows:
+        await db.notification_counters.bulk_write([
+            UpdateOne({"recipient_id": row["_id"]}, {"$set": {"unread": row["unread"], "seeded": True}, "$inc": {"version": 1}}, upsert=True)
+            for row in rows
+        ], ordered=False)
+    await db.notification_counters.delete_many({"recipient_id": {"$nin": [row["_id"] for row in rows]}})
+    print(f"Counters written for {len(rows)} recipients")
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(migrate_notification_recipients())
@@ -1,16 +1,25 @@
-﻿from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Request, Form
+﻿from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Request, Form, Query, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse, Response
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+import json
+import time as time_module
 import uuid
 from datetime import datetime, timezone, timedelta
 from jose import jwt, JWTError
@@ -21,6 +30,7 @@ import random
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import numpy as np
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -45,9 +55,44 @@ async def setup_indices():
         await db.walkers.create_index([("location", "2dsphere")])
         await db.daycares.create_index([("location", "2dsphere")])
         await db.vets.create_index([("location", "2dsphere")])
+        # Slot occupancy counts by provider/date/time
+        await db.bookings.create_index([("service_id", 1), ("date", 1), ("time", 1)])
+        # Request claims and inbox fan-out lookups
+        await db.service_requests.create_index("id", unique=True)
+        await db.provider_inbox.create_index("request_id")
+        await db.provider_inbox.create_index([("provider_id", 1), ("is_dismissed", 1), ("created_at", -1)])
+        # Public shared-trip page
+        await db.share_trip_links.create_index("share_code", unique=True)
+        await db.tracking.create_index([("booking_id", 1), ("timestamp", -1)])
+        await db.safety_events.create_index([("booking_id", 1), ("created_at", -1)])
+        await db.booking_safety_state.create_index("booking_id", unique=True)
+        await db.booking_safety_state.create_index([("status", 1), ("updated_at", -1)])
+        await db.booking_safety_state.create_index("active_sos_alerts")
+        # Keyset pages of a conversation; id breaks created_at ties
+        await db.chat_messages.create_index([("conversation_id", 1), ("created_at", 1), ("id", 1)])
+        await db.notification_counters.create_index("recipient_id", unique=True)
+        # Notification feed pages (all / unread only): always addressed to a concrete user id
+        await db.notifications.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+        await db.notifications.create_index([("user_id", 1), ("read", 1), ("created_at", -1), ("id", -1)])
         logging.info("Database indices verified/created")
     except Exception as e:
         logging.error(f"Error creating indices: {e}")
+    
+    try:
+        await ensure_slot_occupancy()
+    except Exception as e:
+        slot_occupancy_guard.update(enabled=False, error=str(e))
+        logging.error(f"slot_occupancy unique index unavailable, capacity guard degraded: {e}")
+    
+    try:
+        await ensure_location_fixes_collection()
+    except Exception as e:
+        logging.error(f"Error creating location_fixes collection: {e}")
+    
+    try:
+        await ensure_notification_retention()
+    except Exception as e:
+        logging.error(f"Error creating notifications TTL index: {e}")
 
 # Cloudinary Configuration
 cloudinary.config(
@@ -100,12 +145,339 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+class LatencyStats:
+    """Rolling latency samples (ms) for the last `window` operations"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, elapsed_ms: float) -> None:
+        self.count += 1
+        self._samples.append(elapsed_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        if not self._samples:
+            return {"count": self.count, "avg_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self._samples)
+        p99_index = min(len(ordered) - 1, int(len(ordered) * 0.99))
+        return {
+            "count": self.count,
+            "avg_ms": round(sum(ordered) / len(ordered), 2),
+            "p99_ms": round(ordered[p99_index], 2),
+            "max_ms": round(ordered[-1], 2)
+        }
+
+class PasswordService:
+    """Runs bcrypt hashing/verification on a bounded thread pool.
+
+    bcrypt takes hundreds of milliseconds per call; running it inline would
+    block the event loop for every other request. At most `max_workers`
+    hashes run at once, callers beyond that wait in a queue of at most
+    `max_queue` entries and are rejected with 503 when it is full.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queued = 0
+        self.active = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.latency = LatencyStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def _run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Servidor ocupado, intenta de nuevo en unos segundos")
+        
+        started = time_module.perf_counter()
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        waiting = True
+        try:
+            async with self._semaphore:
+                self.queued -= 1
+                waiting = False
+                self.active += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(self._executor, fn, *args)
+                finally:
+                    self.active -= 1
+        finally:
+            # Request cancelled before a worker picked it up
+            if waiting:
+                self.queued -= 1
+            self.latency.record((time_module.perf_counter() - started) * 1000)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "active": self.active,
+            "rejected": self.rejected,
+            "latency": self.latency.snapshot()
+        }
+
+password_service = PasswordService(
+    max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", 4)),
+    max_queue=int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", 200))
+)
+
+class WriteBehindBuffer:
+    """Batches side-effect inserts (notifications, audit events) off the
+    request path.
+
+    add() only queues the documents; a background task writes them with
+    one unordered insert_many per collection every `flush_interval`
+    seconds, or sooner once `batch_size` documents are waiting. Failed
+    batches are retried with backoff; pymongo assigns _id before the first
+    attempt, so a retry of a partially written batch only hits duplicate
+    keys, which count as stored. Documents the server rejected are retried
+    on their own, and the after-insert hook runs for every document as
+    soon as it is known to be stored. When the buffer holds `max_docs` documents,
+    or the flusher isn't running (scripts, shutdown), add() writes inline
+    instead, so nothing is dropped for lack of space. Queued documents are
+    lost if the process dies before they are flushed.
+    """
+
+    def __init__(self, max_docs: int, batch_size: int, flush_interval: float, max_retries: int):
+        self.max_docs = max_docs
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queued = 0
+        self.written = 0
+        self.inline = 0
+        self.retries = 0
+        self.failed = 0
+        self.latency = LatencyStats()
+        self._pending: Dict[str, deque] = {}
+        self._after_insert: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def register(self, collection: str, after_insert) -> None:
+        """Run `await after_insert(docs)` once a batch is stored, e.g. to
+        bump counters only for documents that were actually written"""
+        self._after_insert[collection] = after_insert
+
+    async def add(self, collection: str, docs: List[dict]) -> None:
+        if not docs:
+            return
+        if self._task is None or self._stopping or self.queued + len(docs) > self.max_docs:
+            self.inline += len(docs)
+            rejected = await self._write(collection, docs)
+            if rejected:
+                self.failed += len(rejected)
+                logging.error(f"Write-behind inline write rejected {len(rejected)} {collection} documents")
+            return
+        self._pending.setdefault(collection, deque()).extend(docs)
+        self.queued += len(docs)
+        if self.queued >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop the flusher and write whatever is still queued"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flush failed: {e}")
+
+    async def flush(self) -> None:
+        # add() may register a new collection while a batch is awaited
+        for collection, queue in list(self._pending.items()):
+            while queue:
+                batch = [queue.popleft() for _ in range(min(len(queue), self.batch_size))]
+                self.queued -= len(batch)
+                await self._write_with_retry(collection, batch)
+
+    async def _write_with_retry(self, collection: str, docs: List[dict]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                docs = await self._write(collection, docs)
+                if not docs:
+                    return
+                error = "rejected by the server"
+            except Exception as e:
+                error = e
+            if attempt == self.max_retries:
+                self.failed += len(docs)
+                logging.error(f"Write-behind dropped {len(docs)} {collection} documents: {error}")
+                return
+            self.retries += 1
+            await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+
+    async def _write(self, collection: str, docs: List[dict]) -> List[dict]:
+        """Insert `docs` and run the after-insert hook for the ones stored.
+        Returns the documents the server rejected."""
+        started = time_module.perf_counter()
+        rejected: List[dict] = []
+        try:
+            await db[collection].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                raise
+            # Duplicate keys are documents an earlier attempt already stored
+            rejected_indexes = {
+                error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != 11000
+            }
+            if rejected_indexes:
+                rejected = [doc for index, doc in enumerate(docs) if index in rejected_indexes]
+                docs = [doc for index, doc in enumerate(docs) if index not in rejected_indexes]
+        self.written += len(docs)
+        self.latency.record((time_module.perf_counter() - started) * 1000)
+        
+        after_insert = self._after_insert.get(collection)
+        if after_insert and docs:
+            try:
+                await after_insert(docs)
+            except Exception as e:
+                logging.error(f"Write-behind after-insert hook for {collection} failed: {e}")
+        return rejected
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "max_docs": self.max_docs,
+            "written": self.written,
+            "inline": self.inline,
+            "retries": self.retries,
+            "failed": self.failed,
+            "latency": self.latency.snapshot()
+        }
+
+write_behind = WriteBehindBuffer(
+    max_docs=int(os.environ.get("WRITE_BEHIND_MAX_DOCS", 10000)),
+    batch_size=int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 500)),
+    flush_interval=float(os.environ.get("WRITE_BEHIND_FLUSH_MS", 20)) / 1000,
+    max_retries=int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", 5))
+)
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def build_token_claims(user: dict, profile: Optional[dict] = None) -> dict:
+    """Claims for create_access_token.
+
+    pid (provider profile id) and ver (the user's token_version) let
+    get_token_claims serve read-only hot paths without touching Mongo.
+    """
+    return {
+        "sub": user["id"],
+        "role": user["role"],
+        "pid": profile["id"] if profile else None,
+        "ver": user.get("token_version", 0)
+    }
+
+# ============= IN-PROCESS CACHES =============
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after ttl_seconds.
+
+    Lives in the uvicorn process, so writes made by other processes are only
+    picked up once the entry expires.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time_module.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        self._entries[key] = (time_module.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Any) -> None:
+        self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate) -> None:
+        """Drop every entry whose value matches; O(size), meant for rare writes"""
+        for key in [k for k, (_, value) in self._entries.items() if predicate(value)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+# Authenticated users keyed by the JWT "sub" claim
+user_cache = TTLCache(
+    max_size=int(os.environ.get("USER_CACHE_MAX_SIZE", 10000)),
+    ttl_seconds=float(os.environ.get("USER_CACHE_TTL_SECONDS", 60))
+)
+
+def invalidate_cached_user(user_id: str) -> None:
+    """Call after any write to db.users for this id"""
+    user_cache.invalidate(user_id)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
@@ -113,12 +485,94 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Token inválido")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        user = user_cache.get(user_id)
         if user is None:
-            raise HTTPException(status_code=401, detail="Usuario no encontrado")
-        return user
+            user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+            if user is None:
+                raise HTTPException(status_code=401, detail="Usuario no encontrado")
+            user_cache.set(user_id, user)
+        if payload.get("ver", 0) != user.get("token_version", 0):
+            raise HTTPException(status_code=401, detail="Sesión revocada, inicia sesión de nuevo")
+        # Handlers get their own copy so they can't mutate the cached entry
+        return dict(user)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Token inválido")
+
+PROVIDER_COLLECTIONS = {
+    "walker": "walkers",
+    "daycare": "daycares",
+    "vet": "vets"
+}
+
+# Provider profiles keyed by the owning user's id
+provider_profile_cache = TTLCache(
+    max_size=int(os.environ.get("PROVIDER_CACHE_MAX_SIZE", 5000)),
+    ttl_seconds=float(os.environ.get("PROVIDER_CACHE_TTL_SECONDS", 60))
+)
+
+def invalidate_provider_profile(user_id: str) -> None:
+    """Call after writing to the walker/daycare/vet profile owned by user_id"""
+    provider_profile_cache.invalidate(user_id)
+
+def invalidate_provider_profile_by_id(profile_id: str) -> None:
+    """Same as invalidate_provider_profile when only the profile id is known"""
+    provider_profile_cache.invalidate_where(lambda profile: profile.get("id") == profile_id)
+
+async def load_provider_profile(user: dict) -> Optional[dict]:
+    """Walker/daycare/vet profile of a user, or None for other roles"""
+    collection = PROVIDER_COLLECTIONS.get(user.get("role"))
+    if not collection:
+        return None
+    
+    profile = provider_profile_cache.get(user["id"])
+    if profile is None:
+        profile = await db[collection].find_one({"user_id": user["id"]}, {"_id": 0})
+        if profile is None:
+            return None
+        provider_profile_cache.set(user["id"], profile)
+    return dict(profile)
+
+async def get_current_provider_profile(current_user: dict = Depends(get_current_user)) -> Optional[dict]:
+    """Profile of the authenticated provider.
+
+    FastAPI caches dependency results per request, so a handler and its
+    sub-dependencies share a single lookup.
+    """
+    return await load_provider_profile(current_user)
+
+async def get_token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Identity taken from the JWT alone, for read-only polling endpoints.
+
+    Skips the user lookup and the token_version check, so a revoked token
+    keeps working here until it expires; anything that writes must depend
+    on get_current_user instead.
+    """
+    return await decode_token_claims(credentials.credentials)
+
+async def decode_token_claims(token: str) -> dict:
+    """get_token_claims for a raw token (WebSocket query parameters)"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
+    
+    user_id = payload.get("sub")
+    role = payload.get("role")
+    if user_id is None or role is None:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    
+    profile_id = payload.get("pid")
+    if profile_id is None and role in PROVIDER_COLLECTIONS:
+        # Tokens issued before the profile existed (or before pid was added)
+        profile = await load_provider_profile({"id": user_id, "role": role})
+        profile_id = profile["id"] if profile else None
+    
+    return {
+        "id": user_id,
+        "role": role,
+        "profile_id": profile_id,
+        "token_version": payload.get("ver", 0)
+    }
 
 class GeoJSONLocation(BaseModel):
     type: str = "Point"
@@ -329,7 +783,8 @@ class Booking(BaseModel):
     # GPS Tracking
     gps_tracking_enabled: bool = False
     walker_current_location: Optional[Dict[str, float]] = None
-    location_history: Optional[List[Dict]] = None
+    walk_summary: Optional[Dict[str, Any]] = None
+    safety_flags: Dict[str, Any] = {}
     started_at: Optional[str] = None
     completed_at: Optional[str] = None
     requires_pickup: bool = False
@@ -552,6 +1007,7 @@ class WellnessReport(BaseModel):
     notes: str = ""
     photos: List[str] = []  # base64 encoded images
     location: Optional[Dict[str, float]] = None
+    walk_summary: Optional[Dict[str, Any]] = None  # from the booking, filled on read
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class WellnessReportCreate(BaseModel):
@@ -594,10 +1050,17 @@ class Notification(BaseModel):
     message: str
     data: Dict[str, Any] = {}
     read: bool = False
+    read_at: Optional[datetime] = None  # BSON date; read notifications expire from it
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 # ============= SERVICE REQUESTS & INBOX MODELS =============
 
+def sortable_timestamp(moment: datetime) -> str:
+    """UTC ISO string of fixed width (always microseconds, always +00:00).
+    Service request expiries are stored this way so Mongo can compare them
+    as strings; isoformat() alone drops zero microseconds."""
+    return moment.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
 class ServiceRequest(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -618,7 +1081,7 @@ class ServiceRequest(BaseModel):
     status: str = "pending"
     accepted_by: Optional[str] = None
     accepted_at: Optional[str] = None
-    expires_at: str = Field(default_factory=lambda: (datetime.now(timezone.utc) + timedelta(minutes=15)).isoformat())
+    expires_at: str = Field(default_factory=lambda: sortable_timestamp(datetime.now(timezone.utc) + timedelta(minutes=15)))
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class ServiceRequestCreate(BaseModel):
@@ -647,6 +1110,10 @@ class ProviderInbox(BaseModel):
     service_time: str
     distance_km: float = 0.0
     earnings: float
+    # Copied from the service request so the inbox reads without a join;
+    # kept in sync by sync_inbox_request_status
+    request_status: str = "pending"
+    expires_at: Optional[str] = None
     is_read: bool = False
     is_dismissed: bool = False
     responded_at: Optional[str] = None
@@ -692,6 +1159,7 @@ class ChatMessage(BaseModel):
     sender_role: str
     content: str
     read: bool = False
+    delivered_at: Optional[str] = None
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class ChatConversation(BaseModel):
@@ -705,8 +1173,14 @@ class ChatConversation(BaseModel):
     provider_type: str
     last_message: Optional[str] = None
     last_message_at: Optional[str] = None
+    last_message_id: Optional[str] = None
     owner_unread: int = 0
     provider_unread: int = 0
+    # Read watermarks: everything up to this message has been read
+    owner_last_read_at: Optional[str] = None
+    owner_last_read_message_id: Optional[str] = None
+    provider_last_read_at: Optional[str] = None
+    provider_last_read_message_id: Optional[str] = None
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class SendMessageRequest(BaseModel):
@@ -727,7 +1201,7 @@ async def register(user_data: UserRegister):
     if existing:
         raise HTTPException(status_code=400, detail="El email ya está registrado")
     
-    hashed_pw = hash_password(user_data.password)
+    hashed_pw = await password_service.hash(user_data.password)
     
     role = user_data.role
     phone = user_data.phone
@@ -757,18 +1231,20 @@ async def register(user_data: UserRegister):
     user_dict["password"] = hashed_pw
     
     await db.users.insert_one(user_dict)
+    invalidate_cached_user(user.id)
     
-    token = create_access_token({"sub": user.id, "role": user.role})
+    token = create_access_token(build_token_claims(user_dict))
     return {"token": token, "user": user}
 
 @api_router.post("/auth/login")
 @limiter.limit("5/minute")
 async def login(credentials: UserLogin, request: Request):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user or not await password_service.verify(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Email o contraseña incorrectos")
     
-    token = create_access_token({"sub": user["id"], "role": user["role"]})
+    profile = await load_provider_profile(user)
+    token = create_access_token(build_token_claims(user, profile))
     user.pop("password")
     return {"token": token, "user": user}
 
@@ -776,6 +1252,23 @@ async def login(credentials: UserLogin, request: Request):
 async def get_me(current_user: dict = Depends(get_current_user)):
     return current_user
 
+@api_router.post("/auth/revoke-sessions")
+async def revoke_sessions(
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
+):
+    """Invalidate every token issued so far and return a fresh one"""
+    updated = await db.users.find_one_and_update(
+        {"id": current_user["id"]},
+        {"$inc": {"token_version": 1}},
+        projection={"_id": 0, "password": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    invalidate_cached_user(current_user["id"])
+    
+    token = create_access_token(build_token_claims(updated, profile))
+    return {"message": "Sesiones cerradas en todos los dispositivos", "token": token}
+
 # ============= PROSPECT ENDPOINTS =============
 
 @api_router.post("/prospects", response_model=Prospect)
@@ -917,6 +1410,7 @@ async def verify_walker(walker_id: str, verified: bool, current_user: dict = Dep
         {"id": walker_id},
         {"$set": {"verified": verified, "verification_status": "approved" if verified else "rejected"}}
     )
+    invalidate_provider_profile_by_id(walker_id)
     return {"message": "Estado de verificación actualizado"}
 
 @api_router.post("/walkers/{walker_id}/documents")
@@ -929,6 +1423,7 @@ async def upload_walker_document(walker_id: str, document: str, current_user: di
         {"id": walker_id},
         {"$push": {"documents": document}, "$set": {"verification_status": "pending"}}
     )
+    invalidate_provider_profile(current_user["id"])
     return {"message": "Documento agregado"}
 
 @api_router.post("/daycares", response_model=DaycareProfile)
@@ -1020,6 +1515,7 @@ async def verify_vet(vet_id: str, verified: bool, current_user: dict = Depends(g
         {"id": vet_id},
         {"$set": {"verified": verified, "verification_status": "approved" if verified else "rejected"}}
     )
+    invalidate_provider_profile_by_id(vet_id)
     return {"message": "Estado de verificación actualizado"}
 
 @api_router.post("/vets/{vet_id}/documents")
@@ -1032,6 +1528,7 @@ async def upload_vet_document(vet_id: str, document: str, current_user: dict = D
         {"id": vet_id},
         {"$push": {"documents": document}, "$set": {"verification_status": "pending"}}
     )
+    invalidate_provider_profile(current_user["id"])
     return {"message": "Documento agregado"}
 
 @api_router.post("/pets", response_model=Pet)
@@ -1086,18 +1583,27 @@ async def create_booking(booking_data: BookingCreate, current_user: dict = Depen
         service_name=service.get("name") if service else "Servicio",
         **booking_data.model_dump()
     )
-    await db.bookings.insert_one(booking.model_dump())
+    
+    # Capacity-guarded increment: two owners racing for the last seat can't both get it
+    if not await acquire_booking_slot(booking.model_dump(), service):
+        raise HTTPException(status_code=400, detail="No hay disponibilidad para esta fecha/hora. Este horario acaba de llenarse")
+    try:
+        await db.bookings.insert_one(booking.model_dump())
+    except Exception:
+        await release_booking_slot(booking.model_dump())
+        raise
     return booking
 
 @api_router.get("/bookings", response_model=List[Booking])
-async def get_my_bookings(current_user: dict = Depends(get_current_user)):
+async def get_my_bookings(
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
+):
     if current_user["role"] == "owner":
         bookings = await db.bookings.find({"owner_id": current_user["id"]}, {"_id": 0}).to_list(100)
     elif current_user["role"] == "admin":
         bookings = await db.bookings.find({}, {"_id": 0}).to_list(100)
     else:
-        profile_collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[profile_collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
         if not profile:
             return []
         bookings = await db.bookings.find({"service_id": profile["id"]}, {"_id": 0}).to_list(100)
@@ -1112,17 +1618,15 @@ async def get_booking(booking_id: str, current_user: dict = Depends(get_current_
 
 @api_router.patch("/bookings/{booking_id}/status")
 async def update_booking_status(booking_id: str, status: str, current_user: dict = Depends(get_current_user)):
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Reserva no encontrada")
-    
     update_data = {"status": status}
     if status == "in_progress":
         update_data["started_at"] = datetime.now(timezone.utc).isoformat()
     elif status == "completed":
         update_data["completed_at"] = datetime.now(timezone.utc).isoformat()
     
-    await db.bookings.update_one({"id": booking_id}, {"$set": update_data})
+    booking = await apply_booking_update(booking_id, update_data)
+    if not booking:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
     return {"message": "Estado actualizado", "status": status}
 
 @api_router.post("/bookings/{booking_id}/start")
@@ -1130,17 +1634,12 @@ async def start_walk(booking_id: str, current_user: dict = Depends(get_current_u
     if current_user["role"] != "walker":
         raise HTTPException(status_code=403, detail="Solo paseadores pueden iniciar paseos")
     
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    booking = await apply_booking_update(booking_id, {
+        "status": "in_progress",
+        "started_at": datetime.now(timezone.utc).isoformat()
+    })
     if not booking:
         raise HTTPException(status_code=404, detail="Reserva no encontrada")
-    
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {
-            "status": "in_progress",
-            "started_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
     return {"message": "Paseo iniciado", "started_at": datetime.now(timezone.utc).isoformat()}
 
 @api_router.post("/bookings/{booking_id}/complete")
@@ -1148,29 +1647,23 @@ async def complete_walk(booking_id: str, current_user: dict = Depends(get_curren
     if current_user["role"] != "walker":
         raise HTTPException(status_code=403, detail="Solo paseadores pueden finalizar paseos")
     
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    booking = await apply_booking_update(booking_id, {
+        "status": "completed",
+        "completed_at": datetime.now(timezone.utc).isoformat()
+    })
     if not booking:
         raise HTTPException(status_code=404, detail="Reserva no encontrada")
-    
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {
-            "status": "completed",
-            "completed_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
     return {"message": "Paseo completado", "completed_at": datetime.now(timezone.utc).isoformat()}
 
 @api_router.post("/bookings/{booking_id}/payment")
 async def process_payment(booking_id: str, payment_id: str, current_user: dict = Depends(get_current_user)):
-    booking = await db.bookings.find_one({"id": booking_id, "owner_id": current_user["id"]}, {"_id": 0})
+    booking = await apply_booking_update(
+        booking_id,
+        {"payment_status": "paid", "payment_id": payment_id, "status": "confirmed"},
+        extra_filter={"owner_id": current_user["id"]}
+    )
     if not booking:
         raise HTTPException(status_code=404, detail="Reserva no encontrada")
-    
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {"payment_status": "paid", "payment_id": payment_id, "status": "confirmed"}}
-    )
     return {"message": "Pago procesado exitosamente"}
 
 @api_router.post("/reviews", response_model=Review)
@@ -1197,6 +1690,7 @@ async def create_review(review_data: ReviewCreate, current_user: dict = Depends(
         {"id": review_data.service_id},
         {"$set": {"rating": round(avg_rating, 1), "reviews_count": len(reviews)}}
     )
+    invalidate_provider_profile_by_id(review_data.service_id)
     
     return review
 
@@ -1206,11 +1700,14 @@ async def get_reviews(service_type: str, service_id: str):
     return reviews
 
 @api_router.post("/wellness", response_model=WellnessReport)
-async def create_wellness_report(report_data: WellnessReportCreate, current_user: dict = Depends(get_current_user)):
+async def create_wellness_report(
+    report_data: WellnessReportCreate,
+    current_user: dict = Depends(get_current_user),
+    walker: Optional[dict] = Depends(get_current_provider_profile)
+):
     if current_user["role"] != "walker":
         raise HTTPException(status_code=403, detail="Solo paseadores pueden crear reportes")
     
-    walker = await db.walkers.find_one({"user_id": current_user["id"]}, {"_id": 0})
     if not walker:
         raise HTTPException(status_code=404, detail="Perfil de paseador no encontrado")
     
@@ -1221,11 +1718,16 @@ async def create_wellness_report(report_data: WellnessReportCreate, current_user
     await db.wellness_reports.insert_one(report.model_dump())
     return report
 
+async def get_walk_summary(booking_id: str) -> Optional[dict]:
+    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0, "walk_summary": 1})
+    return booking.get("walk_summary") if booking else None
+
 @api_router.get("/wellness/{booking_id}", response_model=WellnessReport)
 async def get_wellness_report(booking_id: str):
     report = await db.wellness_reports.find_one({"booking_id": booking_id}, {"_id": 0})
     if not report:
         raise HTTPException(status_code=404, detail="Reporte no encontrado")
+    report["walk_summary"] = await get_walk_summary(booking_id)
     return report
 
 @api_router.post("/tracking")
@@ -1240,6 +1742,7 @@ async def update_tracking(tracking_data: TrackingUpdate, current_user: dict = De
         "timestamp": tracking_data.timestamp or datetime.now(timezone.utc).isoformat()
     }
     await db.tracking.insert_one(tracking_entry)
+    invalidate_shared_trip(tracking_data.booking_id)
     return {"message": "Ubicación actualizada"}
 
 @api_router.get("/tracking/{booking_id}")
@@ -1263,6 +1766,107 @@ async def get_incidents(booking_id: str):
 
 # ============= SAFETY & SECURITY ENDPOINTS =============
 
+WALK_OVERDUE_MINUTES = 90
+
+def is_walk_booking(booking: dict) -> bool:
+    """Only walks are tracked and PIN-started, so only they keep a
+    booking_safety_state document through their status changes"""
+    return booking.get("service_type") == "walker"
+
+async def update_safety_state(booking_id: str, set_fields: Optional[dict] = None, inc: Optional[dict] = None) -> None:
+    """Apply $set/$inc to the booking's booking_safety_state document,
+    creating it on first write"""
+    update: Dict[str, Any] = {"$set": {**(set_fields or {}), "updated_at": datetime.now(timezone.utc).isoformat()}}
+    if inc:
+        update["$inc"] = inc
+    await db.booking_safety_state.update_one({"booking_id": booking_id}, update, upsert=True)
+
+async def sync_safety_state(booking_id: str, before: dict, update_data: dict) -> None:
+    """Booking update hook: mirror a walk's status into its safety state"""
+    if "status" in update_data and is_walk_booking(before):
+        await update_safety_state(booking_id, set_fields={
+            "owner_id": before.get("owner_id"),
+            "service_id": before.get("service_id"),
+            "status": update_data["status"],
+            "started_at": update_data.get("started_at", before.get("started_at"))
+        })
+
+async def rebuild_safety_state(booking_id: str) -> Optional[dict]:
+    """Seed a booking's safety state from the source collections.
+    Used for bookings that predate booking_safety_state, or whose document
+    was first created by an incremental write and so has partial counters.
+    Counters are merged with $max rather than replaced so an SOS or
+    check-in $inc racing the rebuild is not overwritten. Other bookings
+    only get a document once an SOS or check-in created one; until then
+    their state is computed without being stored."""
+    booking = await db.bookings.find_one(
+        {"id": booking_id},
+        {"_id": 0, "owner_id": 1, "service_id": 1, "service_type": 1, "status": 1, "started_at": 1,
+         "pin_verified_at": 1, "safety_flags": 1}
+    )
+    if not booking:
+        return None
+    
+    legacy_pin = await db.verification_pins.find_one({"booking_id": booking_id, "verified": True}, {"_id": 1})
+    active_sos, sos_total, check_ins = await asyncio.gather(
+        db.sos_alerts.count_documents({"booking_id": booking_id, "status": "active"}),
+        db.sos_alerts.count_documents({"booking_id": booking_id}),
+        db.safety_checkins.count_documents({"booking_id": booking_id})
+    )
+    set_fields = {
+        "owner_id": booking.get("owner_id"),
+        "service_id": booking.get("service_id"),
+        "status": booking.get("status"),
+        "started_at": booking.get("started_at"),
+        "seeded": True,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    if booking.get("pin_verified_at") or legacy_pin:
+        set_fields["pin_verified"] = True
+        set_fields["pin_verified_at"] = booking.get("pin_verified_at")
+    for name, flag in (booking.get("safety_flags") or {}).items():
+        set_fields[f"safety_flags.{name}"] = flag
+    
+    walk = is_walk_booking(booking)
+    state = await db.booking_safety_state.find_one_and_update(
+        {"booking_id": booking_id},
+        {
+            "$set": set_fields,
+            "$max": {"active_sos_alerts": active_sos, "sos_total": sos_total, "check_ins_count": check_ins}
+        },
+        projection={"_id": 0},
+        upsert=walk,
+        return_document=ReturnDocument.AFTER
+    )
+    if state is None and not walk:
+        state = {key: value for key, value in set_fields.items() if not key.startswith("safety_flags.")}
+        state.update(booking_id=booking_id, safety_flags=booking.get("safety_flags") or {},
+                     active_sos_alerts=active_sos, sos_total=sos_total, check_ins_count=check_ins)
+    return state
+
+def safety_status_from_state(state: dict) -> dict:
+    """API view of a booking_safety_state document"""
+    active_flags = [name for name, flag in (state.get("safety_flags") or {}).items() if flag.get("active")]
+    active_sos = state.get("active_sos_alerts", 0)
+    
+    has_overdue = False
+    if state.get("status") == "in_progress" and state.get("started_at"):
+        started = datetime.fromisoformat(state["started_at"])
+        elapsed = (datetime.now(timezone.utc) - started).total_seconds() / 60
+        if elapsed > WALK_OVERDUE_MINUTES:
+            has_overdue = True
+    
+    return {
+        "booking_id": state["booking_id"],
+        "status": state.get("status"),
+        "pin_verified": state.get("pin_verified", False),
+        "active_sos_alerts": active_sos,
+        "check_ins_count": state.get("check_ins_count", 0),
+        "has_overdue_time": has_overdue,
+        "safety_flags": state.get("safety_flags") or {},
+        "safety_score": "high" if not active_sos and not has_overdue and not active_flags else "medium" if not active_sos else "critical"
+    }
+
 @api_router.post("/emergency-contacts")
 async def add_emergency_contact(contact_data: EmergencyContactCreate, current_user: dict = Depends(get_current_user)):
     contact = EmergencyContact(
@@ -1306,24 +1910,75 @@ async def create_share_trip_link(booking_id: str, current_user: dict = Depends(g
         "expires_at": expires_at
     }
 
+# Booking fields a public shared-trip link may show; PIN, payment and
+# contact details stay private
+SHARED_TRIP_BOOKING_FIELDS = [
+    "id", "pet_name", "service_type", "service_name", "date", "time", "status",
+    "started_at", "completed_at", "walker_current_location", "last_location_at", "walk_summary"
+]
+SHARED_TRIP_ROUTE_TOLERANCE_M = 5.0
+
+# share_code -> {booking_id, expires_at}; links never change once created
+share_link_cache = TTLCache(
+    max_size=int(os.environ.get("SHARE_LINK_CACHE_MAX_SIZE", 5000)),
+    ttl_seconds=float(os.environ.get("SHARE_LINK_CACHE_TTL_SECONDS", 300))
+)
+# booking_id -> {"snapshot", "etag"}; also dropped whenever fixes or booking updates land
+shared_trip_cache = TTLCache(
+    max_size=int(os.environ.get("SHARED_TRIP_CACHE_MAX_SIZE", 2000)),
+    ttl_seconds=float(os.environ.get("SHARED_TRIP_CACHE_TTL_SECONDS", 5))
+)
+
+def invalidate_shared_trip(booking_id: str) -> None:
+    shared_trip_cache.invalidate(booking_id)
+
+async def drop_shared_trip(booking_id: str, before: dict, update_data: dict) -> None:
+    """Booking update hook: any booking change can alter the shared trip"""
+    invalidate_shared_trip(booking_id)
+
+async def build_shared_trip_snapshot(booking_id: str) -> Optional[dict]:
+    booking = await db.bookings.find_one(
+        {"id": booking_id},
+        {"_id": 0, **{field: 1 for field in SHARED_TRIP_BOOKING_FIELDS}}
+    )
+    if not booking:
+        return None
+    tracking = await db.tracking.find({"booking_id": booking_id}, {"_id": 0}).sort("timestamp", -1).to_list(100)
+    route = build_route_payload(await load_route(booking_id), "polyline", SHARED_TRIP_ROUTE_TOLERANCE_M, False)
+    
+    snapshot = {
+        "booking": booking,
+        "tracking": tracking,
+        "route": route,
+        "status": booking.get("status", "unknown")
+    }
+    etag = '"' + hashlib.sha1(json.dumps(snapshot, sort_keys=True, default=str).encode()).hexdigest() + '"'
+    return {"snapshot": snapshot, "etag": etag}
+
 @api_router.get("/track/{share_code}")
-async def get_shared_trip(share_code: str):
-    link = await db.share_trip_links.find_one({"share_code": share_code}, {"_id": 0})
-    if not link:
-        raise HTTPException(status_code=404, detail="Link inválido o expirado")
+async def get_shared_trip(share_code: str, request: Request):
+    link = share_link_cache.get(share_code)
+    if link is None:
+        link = await db.share_trip_links.find_one({"share_code": share_code}, {"_id": 0, "booking_id": 1, "expires_at": 1})
+        if not link:
+            raise HTTPException(status_code=404, detail="Link inválido o expirado")
+        share_link_cache.set(share_code, link)
     
     expires = datetime.fromisoformat(link["expires_at"])
     if datetime.now(timezone.utc) > expires:
         raise HTTPException(status_code=410, detail="Link expirado")
     
-    booking = await db.bookings.find_one({"id": link["booking_id"]}, {"_id": 0})
-    tracking = await db.tracking.find({"booking_id": link["booking_id"]}, {"_id": 0}).sort("timestamp", -1).to_list(100)
+    cached = shared_trip_cache.get(link["booking_id"])
+    if cached is None:
+        cached = await build_shared_trip_snapshot(link["booking_id"])
+        if cached is None:
+            raise HTTPException(status_code=404, detail="Reserva no encontrada")
+        shared_trip_cache.set(link["booking_id"], cached)
     
-    return {
-        "booking": booking,
-        "tracking": tracking,
-        "status": booking.get("status", "unknown")
-    }
+    headers = {"ETag": cached["etag"], "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == cached["etag"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(cached["snapshot"], headers=headers)
 
 
 
@@ -1336,6 +1991,11 @@ async def trigger_sos_alert(booking_id: str, latitude: float, longitude: float,
         longitude=longitude
     )
     await db.sos_alerts.insert_one(sos_alert.model_dump())
+    await update_safety_state(
+        booking_id,
+        set_fields={"last_sos_at": sos_alert.created_at},
+        inc={"active_sos_alerts": 1, "sos_total": 1}
+    )
     
     emergency_contacts = await db.emergency_contacts.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(100)
     
@@ -1359,10 +2019,20 @@ async def resolve_sos_alert(alert_id: str, current_user: dict = Depends(get_curr
     if current_user["role"] not in ["admin", "owner"]:
         raise HTTPException(status_code=403, detail="No autorizado")
     
-    await db.sos_alerts.update_one(
-        {"id": alert_id},
-        {"$set": {"status": "resolved", "resolved_at": datetime.now(timezone.utc).isoformat()}}
+    # Only the first resolve of an active alert moves the counter
+    alert = await db.sos_alerts.find_one_and_update(
+        {"id": alert_id, "status": "active"},
+        {"$set": {"status": "resolved", "resolved_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0, "booking_id": 1}
     )
+    if alert:
+        # Guarded so a state doc that never counted this alert can't go
+        # negative (which would read as an active SOS); unseeded docs are
+        # recounted from sos_alerts on the next safety-status read
+        await db.booking_safety_state.update_one(
+            {"booking_id": alert["booking_id"], "active_sos_alerts": {"$gt": 0}},
+            {"$inc": {"active_sos_alerts": -1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
     return {"message": "Alerta resuelta"}
 
 @api_router.post("/bookings/{booking_id}/check-in")
@@ -1372,35 +2042,25 @@ async def safety_check_in(booking_id: str, current_user: dict = Depends(get_curr
         check_in_time=datetime.now(timezone.utc).isoformat()
     )
     await db.safety_checkins.insert_one(check_in.model_dump())
+    await update_safety_state(
+        booking_id,
+        set_fields={"last_check_in_at": check_in.check_in_time},
+        inc={"check_ins_count": 1}
+    )
     
     return {"message": "Check-in registrado", "time": check_in.check_in_time}
 
 @api_router.get("/bookings/{booking_id}/safety-status")
 async def get_safety_status(booking_id: str, current_user: dict = Depends(get_current_user)):
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Reserva no encontrada")
-    
-    pin_verified = await db.verification_pins.find_one({"booking_id": booking_id, "verified": True}, {"_id": 0})
-    sos_alerts = await db.sos_alerts.find({"booking_id": booking_id, "status": "active"}, {"_id": 0}).to_list(100)
-    check_ins = await db.safety_checkins.find({"booking_id": booking_id}, {"_id": 0}).to_list(100)
-    
-    has_overdue = False
-    if booking.get("status") == "in_progress" and booking.get("started_at"):
-        started = datetime.fromisoformat(booking["started_at"])
-        elapsed = (datetime.now(timezone.utc) - started).total_seconds() / 60
-        if elapsed > 90:
-            has_overdue = True
+    state = await db.booking_safety_state.find_one({"booking_id": booking_id}, {"_id": 0})
+    # Docs created by an incremental write (SOS, check-in, status change)
+    # only count what happened since; seed them once from the sources
+    if not state or not state.get("seeded"):
+        state = await rebuild_safety_state(booking_id)
+        if not state:
+            raise HTTPException(status_code=404, detail="Reserva no encontrada")
     
-    return {
-        "booking_id": booking_id,
-        "status": booking.get("status"),
-        "pin_verified": pin_verified is not None,
-        "active_sos_alerts": len(sos_alerts),
-        "check_ins_count": len(check_ins),
-        "has_overdue_time": has_overdue,
-        "safety_score": "high" if not sos_alerts and not has_overdue else "medium" if not sos_alerts else "critical"
-    }
+    return safety_status_from_state(state)
 
     return {"walkers": walkers, "daycares": daycares}
 
@@ -1419,7 +2079,7 @@ async def seed_admin_user(secret_key: str):
         return {"message": "Admin ya existe", "email": existing["email"]}
     
     admin_email = "admin@pettrust.co"
-    admin_password = hash_password("PetTrust2025!")
+    admin_password = await password_service.hash("PetTrust2025!")
     
     admin_user = {
         "id": str(uuid.uuid4()),
@@ -1432,6 +2092,7 @@ async def seed_admin_user(secret_key: str):
     admin_user["password"] = admin_password
     
     await db.users.insert_one(admin_user)
+    invalidate_cached_user(admin_user["id"])
     return {"message": "Admin creado exitosamente", "email": admin_email}
 
 @api_router.get("/admin/stats")
@@ -1454,6 +2115,68 @@ async def get_admin_stats(current_user: dict = Depends(get_current_user)):
         "pending_prospects": await db.prospects.count_documents({"status": "pending"})
     }
 
+@api_router.get("/admin/safety")
+async def get_admin_safety_dashboard(current_user: dict = Depends(get_current_user)):
+    """Walks needing attention, from booking_safety_state only"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    states = await db.booking_safety_state.find(
+        {"$or": [{"status": "in_progress"}, {"active_sos_alerts": {"$gt": 0}}]},
+        {"_id": 0}
+    ).sort("updated_at", -1).to_list(200)
+    
+    walks = [{**safety_status_from_state(state), "owner_id": state.get("owner_id"), "service_id": state.get("service_id"),
+              "updated_at": state.get("updated_at")} for state in states]
+    return {
+        "in_progress": sum(1 for walk in walks if walk["status"] == "in_progress"),
+        "active_sos": sum(walk["active_sos_alerts"] for walk in walks),
+        "overdue": sum(1 for walk in walks if walk["has_overdue_time"]),
+        "flagged": sum(1 for walk in walks if walk["safety_score"] != "high"),
+        "walks": sorted(walks, key=lambda walk: ["critical", "medium", "high"].index(walk["safety_score"]))
+    }
+
+@api_router.post("/admin/slot-occupancy/rebuild")
+async def rebuild_slot_occupancy_counters(current_user: dict = Depends(get_current_user)):
+    """Recompute slot_occupancy from bookings (initial backfill or repair)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    counters = await rebuild_slot_occupancy()
+    return {"message": "Ocupación recalculada", "counters": counters}
+
+@api_router.post("/admin/notification-counters/rebuild")
+async def rebuild_notification_counter_docs(current_user: dict = Depends(get_current_user)):
+    """Recompute notification_counters from notifications (initial backfill or repair)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    counters = await rebuild_notification_counters()
+    return {"message": "Contadores recalculados", "counters": counters}
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(current_user: dict = Depends(get_current_user)):
+    """In-process cache and worker metrics for this server instance"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    return {
+        "user_cache": user_cache.stats(),
+        "provider_profile_cache": provider_profile_cache.stats(),
+        "password_service": password_service.stats(),
+        "location_hub": location_hub.stats(),
+        "chat_hub": chat_hub.stats(),
+        "route_cache": route_cache.stats(),
+        "shared_trip_cache": shared_trip_cache.stats(),
+        "notification_counter_cache": notification_counter_cache.stats(),
+        "write_behind": write_behind.stats(),
+        "slot_occupancy_guard": slot_occupancy_guard,
+        "inbox_fanout": {
+            "background": INBOX_FANOUT_BACKGROUND,
+            "latency": inbox_fanout_latency.snapshot()
+        }
+    }
+
 @api_router.get("/admin/pending-verifications")
 async def get_pending_verifications(current_user: dict = Depends(get_current_user)):
     """Get all providers waiting for verification"""
@@ -1478,6 +2201,175 @@ async def get_pending_verifications(current_user: dict = Depends(get_current_use
 
 # ============= MATCHING & AVAILABILITY ENDPOINTS =============
 
+# Bookings in these states hold a slot
+ACTIVE_BOOKING_STATUSES = ["pending", "confirmed", "in_progress"]
+
+# ----- Slot occupancy counters -----
+# slot_occupancy holds one document per (service_id, date, time) with the
+# number of active bookings in that slot, plus a per-day total stored under
+# time DAY_OCCUPANCY_KEY. Every write that moves a booking into or out of
+# ACTIVE_BOOKING_STATUSES must go through acquire_booking_slot /
+# release_booking_slot (or apply_booking_update) to keep them in sync.
+
+DAY_OCCUPANCY_KEY = "*"
+SLOT_OCCUPANCY_KEY = [("service_id", 1), ("date", 1), ("time", 1)]
+
+# Cleared at startup when the unique key on slot_occupancy can't be built;
+# reported in /admin/metrics
+slot_occupancy_guard: Dict[str, Any] = {"enabled": True, "error": None}
+
+async def _inc_occupancy(service_id: str, date: str, time: Optional[str], amount: int, capacity: Optional[int] = None) -> bool:
+    key = {"service_id": service_id, "date": date, "time": time}
+    
+    if amount < 0:
+        await db.slot_occupancy.update_one(
+            {**key, "count": {"$gte": -amount}},
+            {"$inc": {"count": amount}}
+        )
+        return True
+    
+    if capacity is None:
+        await db.slot_occupancy.update_one(key, {"$inc": {"count": amount}}, upsert=True)
+        return True
+    
+    if capacity < amount:
+        return False
+    if not slot_occupancy_guard["enabled"]:
+        # Without the unique key a refused upsert would insert a second
+        # counter for the slot, so only the slot's first booking upserts
+        result = await db.slot_occupancy.update_one(
+            {**key, "count": {"$lte": capacity - amount}},
+            {"$inc": {"count": amount}}
+        )
+        if result.matched_count:
+            return True
+        if await db.slot_occupancy.find_one(key, {"_id": 1}):
+            return False
+        await db.slot_occupancy.update_one(key, {"$inc": {"count": amount}}, upsert=True)
+        return True
+    try:
+        # When the slot is full the filter misses, the upsert collides with
+        # the unique key and the increment is refused
+        await db.slot_occupancy.update_one(
+            {**key, "count": {"$lte": capacity - amount}},
+            {"$inc": {"count": amount}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+def booking_slot_capacity(service_type: str, provider: dict) -> tuple:
+    """(per-slot capacity, per-day capacity) for a provider; None means unbounded"""
+    if service_type == "walker":
+        return provider.get("capacity_max", 4), None
+    if service_type in ["daycare", "guarderia"]:
+        return None, provider.get("capacity_total", 20)
+    return None, None
+
+async def acquire_booking_slot(booking: dict, provider: Optional[dict] = None) -> bool:
+    """Count an active booking. With the provider given the increment is
+    capacity-guarded and False means the slot is already full."""
+    slot_capacity, day_capacity = booking_slot_capacity(booking["service_type"], provider) if provider else (None, None)
+    service_id, date = booking["service_id"], booking["date"]
+    
+    if not await _inc_occupancy(service_id, date, booking.get("time"), 1, slot_capacity):
+        return False
+    if not await _inc_occupancy(service_id, date, DAY_OCCUPANCY_KEY, 1, day_capacity):
+        await _inc_occupancy(service_id, date, booking.get("time"), -1)
+        return False
+    return True
+
+async def release_booking_slot(booking: dict) -> None:
+    service_id, date = booking["service_id"], booking["date"]
+    await _inc_occupancy(service_id, date, booking.get("time"), -1)
+    await _inc_occupancy(service_id, date, DAY_OCCUPANCY_KEY, -1)
+
+async def apply_booking_update(booking_id: str, update_data: dict, extra_filter: Optional[dict] = None) -> Optional[dict]:
+    """$set fields on a booking and move its slot_occupancy count when the
+    status enters or leaves ACTIVE_BOOKING_STATUSES, then run
+    BOOKING_UPDATE_HOOKS. Returns the booking as it was before the update,
+    or None if nothing matched."""
+    before = await db.bookings.find_one_and_update(
+        {"id": booking_id, **(extra_filter or {})},
+        {"$set": update_data},
+        projection={"_id": 0, "location_history": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not before:
+        return None
+    if "status" in update_data:
+        was_active = before.get("status") in ACTIVE_BOOKING_STATUSES
+        is_active = update_data["status"] in ACTIVE_BOOKING_STATUSES
+        if was_active and not is_active:
+            await release_booking_slot(before)
+        elif is_active and not was_active:
+            await acquire_booking_slot(before)
+    for hook in BOOKING_UPDATE_HOOKS:
+        await hook(booking_id, before, update_data)
+    return before
+
+async def get_occupancy(service_id: str, date: str, time: Optional[str] = DAY_OCCUPANCY_KEY) -> int:
+    """Active bookings in one slot (or the whole day by default)"""
+    doc = await db.slot_occupancy.find_one(
+        {"service_id": service_id, "date": date, "time": time},
+        {"_id": 0, "count": 1}
+    )
+    return doc["count"] if doc else 0
+
+async def rebuild_slot_occupancy() -> int:
+    """Recompute slot_occupancy from bookings. Bookings written while this
+    runs can be miscounted, so use it for the initial backfill or repairs."""
+    pipeline = [
+        {"$match": {"status": {"$in": ACTIVE_BOOKING_STATUSES}}},
+        {"$group": {"_id": {"service_id": "$service_id", "date": "$date", "time": "$time"}, "count": {"$sum": 1}}}
+    ]
+    rows = await db.bookings.aggregate(pipeline).to_list(None)
+    
+    docs = []
+    day_totals: Dict[tuple, int] = {}
+    for row in rows:
+        key = row["_id"]
+        docs.append({"service_id": key["service_id"], "date": key["date"], "time": key.get("time"), "count": row["count"]})
+        day_key = (key["service_id"], key["date"])
+        day_totals[day_key] = day_totals.get(day_key, 0) + row["count"]
+    for (service_id, date), count in day_totals.items():
+        docs.append({"service_id": service_id, "date": date, "time": DAY_OCCUPANCY_KEY, "count": count})
+    
+    await db.slot_occupancy.delete_many({})
+    if docs:
+        await db.slot_occupancy.insert_many(docs)
+    return len(docs)
+
+async def ensure_slot_occupancy() -> None:
+    """Seed slot_occupancy from bookings on first start and build the
+    unique key the capacity-guarded upsert in _inc_occupancy relies on.
+    Duplicate counters left by a run without the key are rebuilt away."""
+    if not await db.slot_occupancy.find_one({}, {"_id": 1}):
+        counters = await rebuild_slot_occupancy()
+        logging.info(f"Seeded slot_occupancy with {counters} counters")
+    try:
+        await db.slot_occupancy.create_index(SLOT_OCCUPANCY_KEY, unique=True)
+    except DuplicateKeyError:
+        await rebuild_slot_occupancy()
+        await db.slot_occupancy.create_index(SLOT_OCCUPANCY_KEY, unique=True)
+    slot_occupancy_guard.update(enabled=True, error=None)
+
+async def count_active_bookings(service_ids: List[str], date: str, time: Optional[str] = None, by_slot: bool = False) -> Dict[str, int]:
+    """Active bookings per provider for a date, read from slot_occupancy in
+    one query. With by_slot=True only the slot at `time` is counted."""
+    if not service_ids:
+        return {}
+    
+    rows = await db.slot_occupancy.find(
+        {
+            "service_id": {"$in": service_ids},
+            "date": date,
+            "time": time if by_slot else DAY_OCCUPANCY_KEY
+        },
+        {"_id": 0, "service_id": 1, "count": 1}
+    ).to_list(len(service_ids))
+    return {row["service_id"]: row["count"] for row in rows}
 
 
 @api_router.get("/providers/search")
@@ -1533,21 +2425,23 @@ async def search_providers(
         for p in providers: 
             p["distance_km"] = 0.0
 
+    if service_type == "walker":
+        providers = [p for p in providers if p.get("capacity_current", 0) < p.get("capacity_max", 4)]
+    
+    # One aggregation for every candidate instead of a count per provider
+    occupancy = {}
+    if service_type in ["walker", "daycare"]:
+        occupancy = await count_active_bookings(
+            [p["id"] for p in providers], date, time, by_slot=service_type == "walker"
+        )
+    
     results = []
     
     for provider in providers:
         distance_km = provider.get("distance_km", 0.0)
         
         if service_type == "walker":
-            if provider.get("capacity_current", 0) >= provider.get("capacity_max", 4):
-                continue
-            
-            bookings_count = await db.bookings.count_documents({
-                "service_id": provider["id"],
-                "date": date,
-                "time": time,
-                "status": {"$in": ["pending", "confirmed", "in_progress"]}
-            })
+            bookings_count = occupancy.get(provider["id"], 0)
             
             if bookings_count >= provider.get("capacity_max", 4):
                 continue
@@ -1555,11 +2449,7 @@ async def search_providers(
             capacity_available = provider.get("capacity_max", 4) - bookings_count
             
         elif service_type == "daycare":
-            daily_bookings = await db.bookings.count_documents({
-                "service_id": provider["id"],
-                "date": date,
-                "status": {"$in": ["pending", "confirmed", "in_progress"]}
-            })
+            daily_bookings = occupancy.get(provider["id"], 0)
             
             if daily_bookings >= provider.get("capacity_total", 20):
                 continue
@@ -1652,11 +2542,7 @@ async def check_availability(
         
         # If no time specified or slots empty, check general capacity
         if not normalized_time or len(available_slots) == 0:
-            bookings_count = await db.bookings.count_documents({
-                "service_id": service_id,
-                "date": date,
-                "status": {"$in": ["pending", "confirmed", "in_progress"]}
-            })
+            bookings_count = await get_occupancy(service_id, date)
             capacity_max = provider.get("capacity_max", 4) * len(available_slots if available_slots else [1])
             capacity_remaining = max(0, capacity_max - bookings_count)
             
@@ -1678,12 +2564,7 @@ async def check_availability(
             }
         
         # Count bookings for this specific slot
-        bookings_count = await db.bookings.count_documents({
-            "service_id": service_id,
-            "date": date,
-            "time": normalized_time,
-            "status": {"$in": ["pending", "confirmed", "in_progress"]}
-        })
+        bookings_count = await get_occupancy(service_id, date, normalized_time)
         capacity_max = provider.get("capacity_max", 4)
         capacity_remaining = capacity_max - bookings_count
         
@@ -1705,11 +2586,7 @@ async def check_availability(
     
     else:
         # Daycare or Vet - check daily capacity
-        bookings_count = await db.bookings.count_documents({
-            "service_id": service_id,
-            "date": date,
-            "status": {"$in": ["pending", "confirmed", "in_progress"]}
-        })
+        bookings_count = await get_occupancy(service_id, date)
         capacity_max = provider.get("capacity_total", 20)
         capacity_remaining = capacity_max - bookings_count
         
@@ -1720,13 +2597,33 @@ async def check_availability(
             "provider_name": provider.get("name", "")
         }
 
+async def count_slot_bookings(service_id: str, date_from: str, date_to: str) -> Dict[tuple, int]:
+    """Active bookings of one provider per (date, time) over an inclusive date range"""
+    rows = await db.slot_occupancy.find(
+        {
+            "service_id": service_id,
+            "date": {"$gte": date_from, "$lte": date_to},
+            "time": {"$ne": DAY_OCCUPANCY_KEY}
+        },
+        {"_id": 0, "date": 1, "time": 1, "count": 1}
+    ).to_list(None)
+    return {(row["date"], row.get("time")): row["count"] for row in rows}
+
+MAX_SLOT_CALENDAR_DAYS = 30
+
 @api_router.get("/providers/{provider_type}/{provider_id}/slots")
 async def get_provider_slots(
     provider_type: str,
     provider_id: str,
-    date: Optional[str] = None
+    date: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to")
 ):
-    """Get available slots for a provider on a specific date with capacity info"""
+    """Get available slots for a provider on a specific date with capacity info.
+
+    With ?from=YYYY-MM-DD&to=YYYY-MM-DD returns a day x slot grid instead
+    (at most 30 days), computed from a single aggregation.
+    """
     if provider_type == "walker":
         collection = "walkers"
     elif provider_type == "daycare" or provider_type == "guarderia":
@@ -1741,16 +2638,52 @@ async def get_provider_slots(
     available_slots = provider.get("available_slots", ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00", "17:00"])
     capacity_max = provider.get("capacity_max", 4)
     
+    if date_from or date_to:
+        try:
+            start = datetime.strptime(date_from or date_to, "%Y-%m-%d").date()
+            end = datetime.strptime(date_to or date_from, "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Fechas inválidas, usa el formato YYYY-MM-DD")
+        if end < start:
+            raise HTTPException(status_code=400, detail="La fecha final debe ser posterior a la inicial")
+        if (end - start).days + 1 > MAX_SLOT_CALENDAR_DAYS:
+            raise HTTPException(status_code=400, detail=f"El rango máximo es de {MAX_SLOT_CALENDAR_DAYS} días")
+        
+        counts = await count_slot_bookings(provider_id, start.isoformat(), end.isoformat())
+        
+        days = []
+        for offset in range((end - start).days + 1):
+            day = (start + timedelta(days=offset)).isoformat()
+            day_slots = []
+            for slot in available_slots:
+                remaining = capacity_max - counts.get((day, slot), 0)
+                day_slots.append({
+                    "time": slot,
+                    "capacity_remaining": remaining,
+                    "available": remaining > 0
+                })
+            days.append({
+                "date": day,
+                "slots": day_slots,
+                "available": any(s["available"] for s in day_slots)
+            })
+        
+        return {
+            "provider_id": provider_id,
+            "provider_name": provider.get("name", ""),
+            "is_active": provider.get("is_active", False),
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "days": days,
+            "capacity_max_per_slot": capacity_max
+        }
+    
     slots_with_capacity = []
     
     if date:
+        counts = await count_slot_bookings(provider_id, date, date)
         for slot in available_slots:
-            bookings_count = await db.bookings.count_documents({
-                "service_id": provider_id,
-                "date": date,
-                "time": slot,
-                "status": {"$in": ["pending", "confirmed", "in_progress"]}
-            })
+            bookings_count = counts.get((date, slot), 0)
             remaining = capacity_max - bookings_count
             slots_with_capacity.append({
                 "time": slot,
@@ -1777,9 +2710,54 @@ async def get_provider_slots(
 
 # ============= SERVICE REQUESTS ENDPOINTS =============
 
-@api_router.post("/service-requests")
-async def create_service_request(
-    request_data: ServiceRequestCreate,
+# Write provider inboxes after the response is sent instead of before
+INBOX_FANOUT_BACKGROUND = os.environ.get("INBOX_FANOUT_BACKGROUND", "false").lower() == "true"
+inbox_fanout_latency = LatencyStats()
+
+def build_inbox_items(service_request: ServiceRequest, pet: dict, providers: List[dict]) -> List[dict]:
+    """One ProviderInbox document per matched provider"""
+    items = []
+    for provider in providers:
+        if service_request.service_type == "walker":
+            earnings = provider.get("price_per_walk", 25000)
+        elif service_request.service_type == "vet":
+            earnings = provider.get("rates", {}).get("consultation", 50000)
+        else:
+            earnings = provider.get("price_per_day", 80000)
+        
+        items.append(ProviderInbox(
+            provider_id=provider["id"],
+            provider_type=service_request.service_type,
+            request_id=service_request.id,
+            pet_name=pet.get("name", ""),
+            pet_breed=pet.get("breed"),
+            pet_photo=pet.get("photo"),
+            owner_name=service_request.owner_name,
+            service_date=service_request.requested_date,
+            service_time=service_request.requested_time,
+            distance_km=round(provider.get("distance_km", 0.0), 2),
+            earnings=earnings,
+            expires_at=service_request.expires_at
+        ).model_dump())
+    return items
+
+async def fan_out_inbox(items: List[dict]) -> None:
+    """Write inbox items in one unordered insert_many; a bad document
+    doesn't stop the rest from being delivered"""
+    if not items:
+        return
+    started = time_module.perf_counter()
+    try:
+        await db.provider_inbox.insert_many(items, ordered=False)
+    except Exception as e:
+        logging.error(f"Inbox fan-out for request {items[0]['request_id']} failed: {e}")
+    finally:
+        inbox_fanout_latency.record((time_module.perf_counter() - started) * 1000)
+
+@api_router.post("/service-requests")
+async def create_service_request(
+    request_data: ServiceRequestCreate,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     """Create a service request with automatic matching"""
@@ -1827,34 +2805,18 @@ async def create_service_request(
         requested_time=request_data.time,
         requires_pickup=request_data.requires_pickup,
         pickup_address=request_data.pickup_address,
-        pickup_location={"lat": request_data.pickup_lat, "lng": request_data.pickup_lng} if request_data.pickup_lat else None,
+        pickup_location={"lat": request_data.pickup_lat, "lng": request_data.pickup_lng} if request_data.pickup_lat is not None and request_data.pickup_lng is not None else None,
         owner_location={"lat": owner_lat, "lng": owner_lng},
         matched_providers=matched_providers
     )
     
     await db.service_requests.insert_one(service_request.model_dump())
     
-    for provider in matched_providers_data:
-        distance = provider.get("distance_km", 0.0)
-        
-        earnings = provider.get("price_per_walk", 25000) if request_data.service_type == "walker" else provider.get("price_per_day", 80000)
-        if request_data.service_type == "vet":
-             earnings = provider.get("rates", {}).get("consultation", 50000)
-
-        inbox_item = ProviderInbox(
-            provider_id=provider["id"],
-            provider_type=request_data.service_type,
-            request_id=service_request.id,
-            pet_name=pet.get("name", ""),
-            pet_breed=pet.get("breed"),
-            pet_photo=pet.get("photo"),
-            owner_name=current_user["name"],
-            service_date=request_data.date,
-            service_time=request_data.time,
-            distance_km=round(distance, 2),
-            earnings=earnings
-        )
-        await db.provider_inbox.insert_one(inbox_item.model_dump())
+    inbox_items = build_inbox_items(service_request, pet, matched_providers_data)
+    if INBOX_FANOUT_BACKGROUND:
+        background_tasks.add_task(fan_out_inbox, inbox_items)
+    else:
+        await fan_out_inbox(inbox_items)
     
     return {
         "request_id": service_request.id,
@@ -1874,20 +2836,14 @@ async def get_service_request(request_id: str, current_user: dict = Depends(get_
 # ============= PROVIDER DASHBOARD ENDPOINTS =============
 
 @api_router.get("/providers/me/profile")
-async def get_my_provider_profile(current_user: dict = Depends(get_current_user)):
+async def get_my_provider_profile(
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
+):
     """Get current provider's profile"""
-    if current_user["role"] not in ["walker", "daycare", "vet"]:
+    if current_user["role"] not in PROVIDER_COLLECTIONS:
         raise HTTPException(status_code=403, detail="Solo proveedores")
     
-    if current_user["role"] == "walker":
-        collection = "walkers"
-    elif current_user["role"] == "daycare":
-        collection = "daycares"
-    else:
-        collection = "vets"
-
-    profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-    
     if not profile:
         return None
     
@@ -1899,15 +2855,10 @@ async def update_provider_profile(
     current_user: dict = Depends(get_current_user)
 ):
     """Update provider's profile details"""
-    if current_user["role"] not in ["walker", "daycare", "vet"]:
+    if current_user["role"] not in PROVIDER_COLLECTIONS:
         raise HTTPException(status_code=403, detail="Solo proveedores")
     
-    if current_user["role"] == "walker":
-        collection = "walkers"
-    elif current_user["role"] == "daycare":
-        collection = "daycares"
-    else:
-        collection = "vets"
+    collection = PROVIDER_COLLECTIONS[current_user["role"]]
     
     update_data = {k: v for k, v in profile_update.model_dump().items() if v is not None}
     
@@ -1918,6 +2869,7 @@ async def update_provider_profile(
         {"user_id": current_user["id"]},
         {"$set": update_data}
     )
+    invalidate_provider_profile(current_user["id"])
     
     if result.modified_count == 0:
         # Check if profile exists
@@ -1934,15 +2886,10 @@ async def update_provider_status(
     current_user: dict = Depends(get_current_user)
 ):
     """Update provider's active status and settings"""
-    if current_user["role"] not in ["walker", "daycare", "vet"]:
+    if current_user["role"] not in PROVIDER_COLLECTIONS:
         raise HTTPException(status_code=403, detail="Solo proveedores")
     
-    if current_user["role"] == "walker":
-        collection = "walkers"
-    elif current_user["role"] == "daycare":
-        collection = "daycares"
-    else:
-        collection = "vets"
+    collection = PROVIDER_COLLECTIONS[current_user["role"]]
     
     update_data = {}
     if status_update.is_active is not None:
@@ -1959,46 +2906,129 @@ async def update_provider_status(
         {"user_id": current_user["id"]},
         {"$set": update_data}
     )
+    invalidate_provider_profile(current_user["id"])
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Perfil no encontrado")
     
     return {"message": "Estado actualizado", "updates": update_data}
 
+async def check_walker_schedule_conflict(profile: dict, date: str, time: Optional[str]) -> bool:
+    """True when the walker's slot is already at capacity_max"""
+    occupied = await get_occupancy(profile["id"], date, time)
+    return occupied >= profile.get("capacity_max", 4)
+
+async def claim_service_request(request_id: str, provider_id: str, booking_id: str) -> Optional[dict]:
+    """Atomically take a pending, unexpired request for a provider.
+    
+    The status/expiry check and the write are a single find_one_and_update,
+    so when many providers accept at once exactly one gets the document
+    back and the rest get None. expires_at is compared as a string, which
+    relies on it being written by sortable_timestamp."""
+    now = datetime.now(timezone.utc)
+    return await db.service_requests.find_one_and_update(
+        {"id": request_id, "status": "pending", "expires_at": {"$gt": sortable_timestamp(now)}},
+        {"$set": {
+            "status": "accepted",
+            "accepted_by": provider_id,
+            "accepted_at": now.isoformat(),
+            "booking_id": booking_id
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def release_service_request(request_id: str, provider_id: str) -> None:
+    """Give back a claim that couldn't be turned into a booking"""
+    await db.service_requests.update_one(
+        {"id": request_id, "status": "accepted", "accepted_by": provider_id},
+        {"$set": {"status": "pending", "accepted_by": None, "accepted_at": None, "booking_id": None}}
+    )
+
+async def sync_inbox_request_status(request_id: str, request_status: str) -> None:
+    """Mirror a service request's status onto every inbox item for it"""
+    await db.provider_inbox.update_many(
+        {"request_id": request_id},
+        {"$set": {"request_status": request_status}}
+    )
+
+async def dismiss_taken_request(inbox_item: dict) -> None:
+    await db.provider_inbox.update_one(
+        {"id": inbox_item["id"]},
+        {"$set": {"is_dismissed": True, "responded_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    raise HTTPException(status_code=409, detail="Esta solicitud ya fue tomada por otro proveedor")
+
+async def ensure_request_open(inbox_item: dict) -> None:
+    """Raise the matching error when the inbox item's request is missing,
+    already taken or expired (marking it expired on the way)"""
+    request = await db.service_requests.find_one(
+        {"id": inbox_item["request_id"]},
+        {"_id": 0, "status": 1, "expires_at": 1}
+    )
+    if not request:
+        raise HTTPException(status_code=404, detail="Solicitud original no encontrada")
+    if request.get("status") != "pending":
+        await dismiss_taken_request(inbox_item)
+    
+    # Parsed rather than compared as strings: requests stored before
+    # sortable_timestamp may end in Z or lack microseconds
+    expires_at = datetime.fromisoformat(request["expires_at"].replace('Z', '+00:00'))
+    if datetime.now(timezone.utc) > expires_at:
+        await db.service_requests.update_one(
+            {"id": inbox_item["request_id"], "status": "pending"},
+            {"$set": {"status": "expired"}}
+        )
+        await sync_inbox_request_status(inbox_item["request_id"], "expired")
+        raise HTTPException(status_code=410, detail="La solicitud ha expirado")
+
+async def reject_failed_claim(inbox_item: dict) -> None:
+    """Work out why claim_service_request missed and raise the matching error"""
+    await ensure_request_open(inbox_item)
+    # Pending and unexpired: we lost to a claim that has since been released
+    await dismiss_taken_request(inbox_item)
+
 @api_router.get("/providers/me/inbox")
-async def get_provider_inbox(current_user: dict = Depends(get_current_user)):
+async def get_provider_inbox(claims: dict = Depends(get_token_claims)):
     """Get provider's inbox with pending service requests"""
-    if current_user["role"] not in ["walker", "daycare", "vet"]:
+    if claims["role"] not in PROVIDER_COLLECTIONS:
         raise HTTPException(status_code=403, detail="Solo proveedores")
     
-    if current_user["role"] == "walker":
-        collection = "walkers"
-    elif current_user["role"] == "daycare":
-        collection = "daycares"
-    else:
-        collection = "vets"
-
-    profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-    
-    if not profile:
+    if not claims["profile_id"]:
         return []
     
     inbox_items = await db.provider_inbox.find({
-        "provider_id": profile["id"],
+        "provider_id": claims["profile_id"],
         "is_dismissed": False
     }, {"_id": 0}).sort("created_at", -1).to_list(50)
     
+    # Items written before request_status/expires_at were copied onto the
+    # inbox get them from one batched lookup
+    legacy_ids = [item["request_id"] for item in inbox_items if not item.get("expires_at")]
+    if legacy_ids:
+        requests_by_id = {
+            r["id"]: r for r in await db.service_requests.find(
+                {"id": {"$in": legacy_ids}},
+                {"_id": 0, "id": 1, "status": 1, "expires_at": 1}
+            ).to_list(len(legacy_ids))
+        }
+        for item in inbox_items:
+            request = requests_by_id.get(item["request_id"])
+            if request:
+                item["request_status"] = request.get("status")
+                item["expires_at"] = request.get("expires_at")
+    
+    now = datetime.now(timezone.utc)
     enriched_items = []
     for item in inbox_items:
-        request = await db.service_requests.find_one({"id": item["request_id"]}, {"_id": 0})
-        if request and request.get("status") == "pending":
-            expires_at = datetime.fromisoformat(request["expires_at"].replace('Z', '+00:00'))
-            now = datetime.now(timezone.utc)
-            expires_in_seconds = max(0, int((expires_at - now).total_seconds()))
-            
-            item["expires_in_seconds"] = expires_in_seconds
-            item["is_expired"] = expires_in_seconds <= 0
-            enriched_items.append(item)
+        if item.get("request_status", "pending") != "pending" or not item.get("expires_at"):
+            continue
+        expires_at = datetime.fromisoformat(item["expires_at"].replace('Z', '+00:00'))
+        expires_in_seconds = max(0, int((expires_at - now).total_seconds()))
+        
+        item["expires_in_seconds"] = expires_in_seconds
+        item["is_expired"] = expires_in_seconds <= 0
+        enriched_items.append(item)
     
     return enriched_items
 
@@ -2006,24 +3036,16 @@ async def get_provider_inbox(current_user: dict = Depends(get_current_user)):
 async def respond_to_request(
     inbox_id: str,
     action: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
 ):
     """Respond to a service request (accept/reject)"""
-    if current_user["role"] not in ["walker", "daycare", "vet"]:
+    if current_user["role"] not in PROVIDER_COLLECTIONS:
         raise HTTPException(status_code=403, detail="Solo proveedores")
     
     if action not in ["accept", "reject"]:
         raise HTTPException(status_code=400, detail="Acción inválida")
     
-    if current_user["role"] == "walker":
-        collection = "walkers"
-    elif current_user["role"] == "daycare":
-        collection = "daycares"
-    else:
-        collection = "vets"
-
-    profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-    
     if not profile:
         raise HTTPException(status_code=404, detail="Perfil no encontrado")
     
@@ -2035,61 +3057,37 @@ async def respond_to_request(
     if not inbox_item:
         raise HTTPException(status_code=404, detail="Solicitud no encontrada")
     
-    request = await db.service_requests.find_one({"id": inbox_item["request_id"]}, {"_id": 0})
-    
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitud original no encontrada")
-    
-    if request.get("status") != "pending":
-        await db.provider_inbox.update_one(
-            {"id": inbox_id},
-            {"$set": {"is_dismissed": True, "responded_at": datetime.now(timezone.utc).isoformat()}}
-        )
-        raise HTTPException(status_code=409, detail="Esta solicitud ya fue tomada por otro proveedor")
-    
-    expires_at = datetime.fromisoformat(request["expires_at"].replace('Z', '+00:00'))
-    if datetime.now(timezone.utc) > expires_at:
-        await db.service_requests.update_one(
-            {"id": request["id"]},
-            {"$set": {"status": "expired"}}
-        )
-        raise HTTPException(status_code=410, detail="La solicitud ha expirado")
+    now = datetime.now(timezone.utc).isoformat()
     
     if action == "reject":
+        await ensure_request_open(inbox_item)
         await db.provider_inbox.update_one(
             {"id": inbox_id},
-            {"$set": {"is_dismissed": True, "responded_at": datetime.now(timezone.utc).isoformat()}}
+            {"$set": {"is_dismissed": True, "responded_at": now}}
         )
         return {"message": "Solicitud rechazada"}
     
-    await db.service_requests.update_one(
-        {"id": request["id"]},
-        {"$set": {
-            "status": "accepted",
-            "accepted_by": profile["id"],
-            "accepted_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
-    # Check for schedule conflicts (only for walkers)
+    # Cheap point read so a full walker doesn't claim a request only to give it back
     if current_user["role"] == "walker":
         has_conflict = await check_walker_schedule_conflict(
-            profile["id"],
-            request["requested_date"],
-            request["requested_time"]
+            profile,
+            inbox_item["service_date"],
+            inbox_item["service_time"]
         )
         if has_conflict:
-            # Revert status
-            await db.service_requests.update_one(
-                {"id": request["id"]},
-                {"$set": {"status": "pending", "accepted_by": None, "accepted_at": None}}
-            )
             raise HTTPException(
                 status_code=409, 
                 detail="Ya tienes una reserva a esta hora. No puedes aceptar dos paseos simultáneos."
             )
     
+    booking_id = str(uuid.uuid4())
+    request = await claim_service_request(inbox_item["request_id"], profile["id"], booking_id)
+    
+    if not request:
+        await reject_failed_claim(inbox_item)
+    
     booking = Booking(
+        id=booking_id,
         owner_id=request["owner_id"],
         owner_name=request.get("owner_name"),
         pet_id=request["pet_id"],
@@ -2102,31 +3100,38 @@ async def respond_to_request(
         status="confirmed",
         price=inbox_item["earnings"],
         requires_pickup=request.get("requires_pickup", False),
-        pickup_address=request.get("pickup_address")
+        pickup_address=request.get("pickup_address"),
+        pickup_coordinates=coordinates_of(request.get("pickup_location"))
     )
     
-    await db.bookings.insert_one(booking.model_dump())
-    
-    await db.service_requests.update_one(
-        {"id": request["id"]},
-        {"$set": {"booking_id": booking.id}}
-    )
+    if not await acquire_booking_slot(booking.model_dump(), profile):
+        await release_service_request(request["id"], profile["id"])
+        raise HTTPException(status_code=409, detail="No tienes cupo disponible en este horario")
     
+    # The claim and the slot are undone if the booking can't be stored, as
+    # in create_booking; the inbox and walker writes only follow a stored booking
+    try:
+        await db.bookings.insert_one(booking.model_dump())
+    except Exception:
+        await release_booking_slot(booking.model_dump())
+        await release_service_request(request["id"], profile["id"])
+        raise
+    
+    writes = [
+        db.provider_inbox.bulk_write([
+            UpdateMany({"request_id": request["id"]}, {"$set": {"is_dismissed": True, "request_status": "accepted"}}),
+            UpdateOne({"id": inbox_id}, {"$set": {"responded_at": now}})
+        ], ordered=False)
+    ]
     if current_user["role"] == "walker":
-        await db.walkers.update_one(
+        writes.append(db.walkers.update_one(
             {"id": profile["id"]},
             {"$inc": {"capacity_current": 1}}
-        )
+        ))
+    await asyncio.gather(*writes)
     
-    await db.provider_inbox.update_many(
-        {"request_id": request["id"]},
-        {"$set": {"is_dismissed": True}}
-    )
-    
-    await db.provider_inbox.update_one(
-        {"id": inbox_id},
-        {"$set": {"responded_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    if current_user["role"] == "walker":
+        invalidate_provider_profile(current_user["id"])
     
     return {
         "message": "Solicitud aceptada exitosamente",
@@ -2137,15 +3142,13 @@ async def respond_to_request(
 @api_router.get("/providers/me/schedule")
 async def get_provider_schedule(
     date: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
 ):
     """Get provider's booking schedule"""
     if current_user["role"] not in ["walker", "daycare"]:
         raise HTTPException(status_code=403, detail="Solo proveedores")
     
-    collection = "walkers" if current_user["role"] == "walker" else "daycares"
-    profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-    
     if not profile:
         return {"bookings": [], "capacity_used": 0}
     
@@ -2213,10 +3216,7 @@ async def submit_manual_payment(
     await db.manual_payments.insert_one(payment.model_dump())
     
     # Update booking status
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {"status": "awaiting_approval", "payment_status": "pending_approval"}}
-    )
+    await apply_booking_update(booking_id, {"status": "awaiting_approval", "payment_status": "pending_approval"})
     
     return payment
 
@@ -2266,24 +3266,22 @@ async def review_payment(
         booking = await db.bookings.find_one({"id": payment.get("booking_id")})
         if booking:
             # Notify Owner
-            user_notification = Notification(
-                user_id=booking["owner_id"],
+            await dispatch_notification(
+                users=[booking["owner_id"]],
                 type="payment_approved",
                 title="¡Pago Confirmado!",
                 message="Tu pago ha sido verificado. El paseador ha sido notificado y el PIN está disponible.",
                 data={"booking_id": payment.get("booking_id")}
             )
-            await db.notifications.insert_one(user_notification.model_dump())
             
             # Notify Provider
-            provider_notification = Notification(
-                user_id=booking["service_id"],
+            await dispatch_notification(
+                providers=[booking["service_id"]],
                 type="booking_confirmed",
                 title="Nueva Reserva Confirmada",
                 message=f"Tienes una reserva confirmada para {booking['date']} a las {booking.get('time', 'N/A')}. Puedes ver el detalle en tu agenda.",
                 data={"booking_id": payment.get("booking_id")}
             )
-            await db.notifications.insert_one(provider_notification.model_dump())
         
     elif action == "reject":
         new_status = "rejected"
@@ -2297,10 +3295,7 @@ async def review_payment(
         {"$set": {"status": new_status}}
     )
     
-    await db.bookings.update_one(
-        {"id": payment.get("booking_id")},
-        {"$set": {"status": booking_status, "payment_status": payment_status}}
-    )
+    await apply_booking_update(payment.get("booking_id"), {"status": booking_status, "payment_status": payment_status})
     
     return {"message": f"Pago {new_status}", "status": new_status}
 
@@ -2361,15 +3356,12 @@ async def confirm_wompi_payment(
         }}
     )
     
-    await db.bookings.update_one(
-        {"id": transaction["booking_id"]},
-        {"$set": {
-            "payment_status": "paid",
-            "payment_id": transaction["wompi_id"],
-            "wompi_transaction_id": transaction_id,
-            "status": "confirmed"
-        }}
-    )
+    await apply_booking_update(transaction["booking_id"], {
+        "payment_status": "paid",
+        "payment_id": transaction["wompi_id"],
+        "wompi_transaction_id": transaction_id,
+        "status": "confirmed"
+    })
     
     return {
         "message": "Pago confirmado exitosamente (MOCK)",
@@ -2416,9 +3408,9 @@ async def wompi_webhook(payload: Dict[str, Any]):
                 )
                 
                 if status == "APPROVED":
-                    await db.bookings.update_one(
-                        {"id": transaction["booking_id"]},
-                        {"$set": {"payment_status": "paid", "status": "confirmed"}}
+                    await apply_booking_update(
+                        transaction["booking_id"],
+                        {"payment_status": "paid", "status": "confirmed"}
                     )
     
     return {"received": True}
@@ -2540,13 +3532,14 @@ async def seed_demo_data():
         admin_user = {
             "id": str(uuid.uuid4()),
             "email": "admin@pettrust.com",
-            "password": hash_password("admin123"),
+            "password": await password_service.hash("admin123"),
             "name": "Admin PetTrust",
             "role": "admin",
             "phone": "+57 300 000 0000",
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         await db.users.insert_one(admin_user)
+        invalidate_cached_user(admin_user["id"])
     
     return {
         "message": "Datos demo creados exitosamente",
@@ -2556,14 +3549,228 @@ async def seed_demo_data():
 
 # ============= CHAT ENDPOINTS =============
 
+CHAT_CONNECTION_QUEUE_SIZE = 100
+CHAT_RESUME_LIMIT = 200
+CHAT_PAGE_SIZE = 50
+CHAT_MAX_PAGE_SIZE = 200
+
+def encode_cursor(*values: str) -> str:
+    """Opaque keyset cursor for a position in a sorted listing"""
+    return base64.urlsafe_b64encode("|".join(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, parts: int) -> List[str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if len(values) != parts:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
+def message_cursor(message: dict) -> str:
+    return encode_cursor(message["created_at"], message["id"])
+
+async def load_message_page(
+    conversation_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = CHAT_PAGE_SIZE
+) -> Dict[str, Any]:
+    """A page of messages ordered by (created_at, id), oldest first.
+
+    Without a cursor this is the newest page; `before` walks back into
+    older history and `after` catches up on newer messages. Each page is
+    an index range scan, so its cost doesn't grow with the thread.
+    """
+    query: Dict[str, Any] = {"conversation_id": conversation_id}
+    cursor = before or after
+    if cursor:
+        created_at, message_id = decode_cursor(cursor, 2)
+        op = "$lt" if before else "$gt"
+        query["$or"] = [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "id": {op: message_id}}
+        ]
+    
+    direction = 1 if after else -1
+    messages = await db.chat_messages.find(query, {"_id": 0}).sort(
+        [("created_at", direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
+    
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "before_cursor": message_cursor(messages[0]) if messages else before,
+        "after_cursor": message_cursor(messages[-1]) if messages else after
+    }
+
+class ChatConnection:
+    """One chat WebSocket: the authenticated user plus an outbound queue"""
+
+    def __init__(self, user: dict, profile: Optional[dict]):
+        self.user = user
+        self.profile = profile
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=CHAT_CONNECTION_QUEUE_SIZE)
+        self.rooms: Dict[str, str] = {}  # conversation id -> "owner" | "provider"
+        self.overflowed = False
+
+    def send(self, message: dict) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Chat can't drop messages like live GPS does; the socket is
+            # closed instead and the client resumes from its last message id
+            self.overflowed = True
+
+class ChatHub:
+    """In-process rooms of chat connections keyed by conversation id.
+    Like LocationHub it only reaches sockets on this server process."""
+
+    def __init__(self):
+        self._rooms: Dict[str, set] = {}
+        self.published = 0
+        self.overflows = 0
+
+    def join(self, conversation_id: str, side: str, connection: ChatConnection) -> None:
+        self._rooms.setdefault(conversation_id, set()).add(connection)
+        connection.rooms[conversation_id] = side
+
+    def leave(self, conversation_id: str, connection: ChatConnection) -> None:
+        room = self._rooms.get(conversation_id)
+        connection.rooms.pop(conversation_id, None)
+        if room is None:
+            return
+        room.discard(connection)
+        if not room:
+            del self._rooms[conversation_id]
+
+    def leave_all(self, connection: ChatConnection) -> None:
+        for conversation_id in list(connection.rooms):
+            self.leave(conversation_id, connection)
+
+    def publish(self, conversation_id: str, message: dict) -> None:
+        for connection in self._rooms.get(conversation_id, ()):
+            was_overflowed = connection.overflowed
+            connection.send(message)
+            if connection.overflowed and not was_overflowed:
+                self.overflows += 1
+            self.published += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rooms": len(self._rooms),
+            "connections": len({c for room in self._rooms.values() for c in room}),
+            "published": self.published,
+            "overflows": self.overflows
+        }
+
+chat_hub = ChatHub()
+
+def conversation_side(conversation: dict, user: dict, profile: Optional[dict]) -> Optional[str]:
+    """'owner' or 'provider' for a participant, None for anyone else"""
+    if conversation["owner_id"] == user["id"]:
+        return "owner"
+    if profile and profile["id"] == conversation["provider_id"]:
+        return "provider"
+    return None
+
+async def post_chat_message(conversation: dict, side: str, user: dict, profile: Optional[dict], content: str) -> dict:
+    """Store a message, bump the other side's unread count and push it to the room"""
+    message = ChatMessage(
+        conversation_id=conversation["id"],
+        sender_id=profile["id"] if side == "provider" else user["id"],
+        sender_name=user["name"],
+        sender_role=user["role"],
+        content=content
+    )
+    
+    await db.chat_messages.insert_one(message.model_dump())
+    
+    update_data = {
+        "last_message": content[:100],
+        "last_message_at": message.created_at,
+        "last_message_id": message.id
+    }
+    unread_field = "provider_unread" if side == "owner" else "owner_unread"
+    await db.conversations.update_one(
+        {"id": conversation["id"]},
+        {"$set": update_data, "$inc": {unread_field: 1}}
+    )
+    
+    chat_hub.publish(conversation["id"], {"type": "message", "message": message.model_dump()})
+    return message.model_dump()
+
+async def mark_conversation_read(conversation: dict, side: str) -> None:
+    """Move the reader's watermark up to the conversation's last message.
+
+    One small write on the conversation instead of flagging each message;
+    nothing is written when the reader is already caught up. The write is
+    conditional on the last message, so a message that lands in between
+    keeps its unread count until the next read.
+    """
+    last_message_id = conversation.get("last_message_id")
+    already_read = (
+        conversation.get(f"{side}_unread", 0) == 0
+        and conversation.get(f"{side}_last_read_message_id") == last_message_id
+        and conversation.get(f"{side}_last_read_at") == conversation.get("last_message_at")
+    )
+    if already_read:
+        return
+    
+    read_at = conversation.get("last_message_at")
+    watermark = {
+        f"{side}_last_read_at": read_at,
+        f"{side}_last_read_message_id": last_message_id,
+        f"{side}_unread": 0
+    }
+    result = await db.conversations.update_one(
+        {"id": conversation["id"], "last_message_id": last_message_id},
+        {"$set": watermark}
+    )
+    if not result.matched_count:
+        # A message landed since `conversation` was read: report the stored
+        # watermarks rather than ones that were never written
+        stored = await db.conversations.find_one({"id": conversation["id"]}, {"_id": 0})
+        if stored:
+            conversation.update(stored)
+        return
+    conversation.update(watermark)
+    chat_hub.publish(conversation["id"], {
+        "type": "receipt",
+        "kind": "read",
+        "conversation_id": conversation["id"],
+        "reader": side,
+        "last_read_at": read_at,
+        "last_read_message_id": last_message_id,
+        "at": datetime.now(timezone.utc).isoformat()
+    })
+
+def apply_read_watermarks(messages: List[dict], conversation: dict) -> List[dict]:
+    """Derive each message's read flag from the recipient's watermark.
+    Messages flagged individually before watermarks existed stay read."""
+    for message in messages:
+        reader = "provider" if message["sender_role"] == "owner" else "owner"
+        watermark = conversation.get(f"{reader}_last_read_at")
+        message["read"] = bool(message.get("read") or (watermark and message["created_at"] <= watermark))
+    return messages
+
 @api_router.get("/conversations")
-async def get_conversations(current_user: dict = Depends(get_current_user)):
+async def get_conversations(
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
+):
     """Get all conversations for current user"""
     if current_user["role"] == "owner":
         query = {"owner_id": current_user["id"]}
     else:
-        collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
         if not profile:
             return []
         query = {"provider_id": profile["id"]}
@@ -2608,126 +3815,241 @@ async def start_conversation(
 @api_router.get("/conversations/{conversation_id}")
 async def get_conversation(
     conversation_id: str,
-    current_user: dict = Depends(get_current_user)
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=CHAT_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
 ):
-    """Get a specific conversation with messages"""
+    """Get a specific conversation with a page of messages.
+
+    Returns the newest `limit` messages; pass `before_cursor` back as
+    `before` to load older ones (while `has_more`), or `after_cursor` as
+    `after` to fetch what arrived since.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Usa solo uno de before o after")
+    
     conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
     
-    is_owner = conversation["owner_id"] == current_user["id"]
-    is_provider = False
-    if current_user["role"] in ["walker", "daycare"]:
-        collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-        if profile and profile["id"] == conversation["provider_id"]:
-            is_provider = True
-    
-    if not is_owner and not is_provider:
+    side = conversation_side(conversation, current_user, profile)
+    if not side:
         raise HTTPException(status_code=403, detail="Sin acceso a esta conversación")
     
-    messages = await db.chat_messages.find(
-        {"conversation_id": conversation_id}, {"_id": 0}
-    ).sort("created_at", 1).to_list(200)
+    page = await load_message_page(conversation_id, before, after, limit)
+    apply_read_watermarks(page["messages"], conversation)
     
-    if is_owner:
-        await db.conversations.update_one(
-            {"id": conversation_id},
-            {"$set": {"owner_unread": 0}}
-        )
-        await db.chat_messages.update_many(
-            {"conversation_id": conversation_id, "sender_role": {"$ne": "owner"}, "read": False},
-            {"$set": {"read": True}}
-        )
-    else:
-        await db.conversations.update_one(
-            {"id": conversation_id},
-            {"$set": {"provider_unread": 0}}
-        )
-        await db.chat_messages.update_many(
-            {"conversation_id": conversation_id, "sender_role": "owner", "read": False},
-            {"$set": {"read": True}}
-        )
+    # Scrolling back through history doesn't change what has been read
+    if not before:
+        await mark_conversation_read(conversation, side)
     
     return {
         "conversation": conversation,
-        "messages": messages
+        **page
     }
 
 @api_router.post("/conversations/{conversation_id}/messages")
 async def send_message(
     conversation_id: str,
     request: SendMessageRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
 ):
     """Send a message in a conversation"""
     conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
     
-    is_owner = conversation["owner_id"] == current_user["id"]
-    is_provider = False
-    sender_id = current_user["id"]
-    
-    if current_user["role"] in ["walker", "daycare"]:
-        collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-        if profile and profile["id"] == conversation["provider_id"]:
-            is_provider = True
-            sender_id = profile["id"]
-    
-    if not is_owner and not is_provider:
+    side = conversation_side(conversation, current_user, profile)
+    if not side:
         raise HTTPException(status_code=403, detail="Sin acceso a esta conversación")
     
-    message = ChatMessage(
-        conversation_id=conversation_id,
-        sender_id=sender_id,
-        sender_name=current_user["name"],
-        sender_role=current_user["role"],
-        content=request.content
-    )
-    
-    await db.chat_messages.insert_one(message.model_dump())
-    
-    update_data = {
-        "last_message": request.content[:100],
-        "last_message_at": message.created_at
-    }
-    
-    if is_owner:
-        await db.conversations.update_one(
-            {"id": conversation_id},
-            {"$set": update_data, "$inc": {"provider_unread": 1}}
-        )
-    else:
-        await db.conversations.update_one(
-            {"id": conversation_id},
-            {"$set": update_data, "$inc": {"owner_unread": 1}}
-        )
-    
-    return message.model_dump()
+    return await post_chat_message(conversation, side, current_user, profile, request.content)
 
 @api_router.get("/conversations/unread/count")
-async def get_unread_count(current_user: dict = Depends(get_current_user)):
+async def get_unread_count(claims: dict = Depends(get_token_claims)):
     """Get total unread messages count"""
-    if current_user["role"] == "owner":
+    if claims["role"] == "owner":
         pipeline = [
-            {"$match": {"owner_id": current_user["id"]}},
+            {"$match": {"owner_id": claims["id"]}},
             {"$group": {"_id": None, "total": {"$sum": "$owner_unread"}}}
         ]
     else:
-        collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-        if not profile:
+        if not claims["profile_id"]:
             return {"unread_count": 0}
         pipeline = [
-            {"$match": {"provider_id": profile["id"]}},
+            {"$match": {"provider_id": claims["profile_id"]}},
             {"$group": {"_id": None, "total": {"$sum": "$provider_unread"}}}
         ]
     
     result = await db.conversations.aggregate(pipeline).to_list(1)
     return {"unread_count": result[0]["total"] if result else 0}
 
+async def build_resume_frame(conversation: dict, after: str) -> dict:
+    """Next page of messages a reconnecting client missed, oldest first.
+    While has_more is set the client asks for the rest with a "resume"
+    command carrying after_cursor."""
+    page = await load_message_page(conversation["id"], after=after, limit=CHAT_RESUME_LIMIT)
+    return {
+        "type": "resume",
+        "conversation_id": conversation["id"],
+        "messages": apply_read_watermarks(page["messages"], conversation),
+        "has_more": page["has_more"],
+        "after_cursor": page["after_cursor"]
+    }
+
+async def handle_chat_command(connection: ChatConnection, command: dict) -> None:
+    """One client frame on the chat socket; replies go through the connection queue"""
+    kind = command.get("type")
+    conversation_id = command.get("conversation_id")
+    
+    if kind == "ping":
+        connection.send({"type": "pong"})
+        return
+    
+    if kind == "subscribe":
+        conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversación no encontrada")
+        side = conversation_side(conversation, connection.user, connection.profile)
+        if not side:
+            raise HTTPException(status_code=403, detail="Sin acceso a esta conversación")
+        last_message = None
+        if command.get("last_message_id"):
+            last_message = await db.chat_messages.find_one(
+                {"id": command["last_message_id"], "conversation_id": conversation_id},
+                {"_id": 0, "id": 1, "created_at": 1}
+            )
+            if not last_message:
+                raise HTTPException(status_code=404, detail="Mensaje no encontrado en esta conversación")
+        # Join before reading the backlog so nothing posted in between is
+        # lost; the client drops duplicates by message id
+        chat_hub.join(conversation_id, side, connection)
+        connection.send({"type": "subscribed", "conversation_id": conversation_id})
+        if last_message:
+            connection.send(await build_resume_frame(conversation, message_cursor(last_message)))
+        return
+    
+    if kind not in ["unsubscribe", "resume", "send", "delivered", "read"]:
+        raise HTTPException(status_code=400, detail="Tipo de mensaje no soportado")
+    
+    side = connection.rooms.get(conversation_id)
+    if not side:
+        raise HTTPException(status_code=409, detail="No estás suscrito a esta conversación")
+    
+    if kind == "unsubscribe":
+        chat_hub.leave(conversation_id, connection)
+    elif kind == "resume":
+        if not command.get("after"):
+            raise HTTPException(status_code=400, detail="Falta el cursor after")
+        conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
+        if conversation:
+            connection.send(await build_resume_frame(conversation, command["after"]))
+    elif kind == "send":
+        content = str(command.get("content") or "").strip()
+        if not content:
+            raise HTTPException(status_code=400, detail="El mensaje está vacío")
+        message = await post_chat_message({"id": conversation_id}, side, connection.user, connection.profile, content)
+        connection.send({"type": "ack", "client_id": command.get("client_id"), "message": message})
+    elif kind == "delivered":
+        message_ids = [str(m) for m in (command.get("message_ids") or [])][:CHAT_RESUME_LIMIT]
+        if not message_ids:
+            return
+        # Only the other side's messages can be acknowledged as delivered
+        sender_filter = {"sender_role": {"$ne": "owner"}} if side == "owner" else {"sender_role": "owner"}
+        delivered_at = datetime.now(timezone.utc).isoformat()
+        await db.chat_messages.update_many(
+            {"id": {"$in": message_ids}, "conversation_id": conversation_id, "delivered_at": None, **sender_filter},
+            {"$set": {"delivered_at": delivered_at}}
+        )
+        chat_hub.publish(conversation_id, {
+            "type": "receipt",
+            "kind": "delivered",
+            "conversation_id": conversation_id,
+            "message_ids": message_ids,
+            "reader": side,
+            "at": delivered_at
+        })
+    else:
+        conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
+        if conversation:
+            await mark_conversation_read(conversation, side)
+
+@api_router.websocket("/chat/ws")
+async def chat_socket(websocket: WebSocket, token: str = Query(...)):
+    """Chat gateway replacing conversation polling.
+
+    Clients subscribe to conversations (optionally passing last_message_id
+    to receive what they missed while disconnected), send messages, and
+    acknowledge delivery and reads; new messages and receipts are pushed to
+    every socket subscribed to the conversation on this server process.
+    """
+    try:
+        user = await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+        profile = await load_provider_profile(user)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    
+    await websocket.accept()
+    connection = ChatConnection(user, profile)
+    
+    async def read_commands():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            try:
+                command = json.loads(message.get("text") or "")
+                if not isinstance(command, dict):
+                    raise ValueError
+            except ValueError:
+                connection.send({"type": "error", "detail": "Mensaje inválido"})
+                continue
+            try:
+                await handle_chat_command(connection, command)
+            except HTTPException as e:
+                connection.send({
+                    "type": "error",
+                    "request": command.get("type"),
+                    "client_id": command.get("client_id"),
+                    "conversation_id": command.get("conversation_id"),
+                    "status": e.status_code,
+                    "detail": e.detail
+                })
+    
+    receiver = asyncio.create_task(read_commands())
+    # The getter outlives heartbeat timeouts: cancelling it could drop a
+    # message it had just taken off the queue
+    getter = asyncio.create_task(connection.queue.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {getter, receiver},
+                timeout=LIVE_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter in done:
+                await websocket.send_json(getter.result())
+                getter = asyncio.create_task(connection.queue.get())
+            if receiver in done:
+                break
+            if connection.overflowed:
+                # Too far behind to catch up in order; the client reconnects
+                # and resumes from the last message it has
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Reconecta y reanuda")
+                break
+            if not done:
+                await websocket.send_json({"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        getter.cancel()
+        chat_hub.leave_all(connection)
+
 # ============= REVIEWS ENDPOINTS =============
 
 @api_router.post("/reviews")
@@ -2778,15 +4100,15 @@ async def create_review(
         {"id": booking["service_id"]},
         {"$set": {"rating": round(avg_rating, 1), "reviews_count": len(all_reviews)}}
     )
+    invalidate_provider_profile_by_id(booking["service_id"])
     
-    notification = Notification(
-        user_id=booking["service_id"],
+    await dispatch_notification(
+        providers=[booking["service_id"]],
         type="review",
         title="Nueva Reseña",
         message=f"{current_user['name']} te dejó una reseña de {review_data.rating} estrellas",
         data={"review_id": review.id, "rating": review_data.rating}
     )
-    await db.notifications.insert_one(notification.model_dump())
     
     return review.model_dump()
 
@@ -2810,13 +4132,13 @@ async def get_booking_review(booking_id: str, current_user: dict = Depends(get_c
 @api_router.post("/wellness-reports")
 async def create_wellness_report(
     report_data: WellnessReportCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
 ):
     """Create a wellness report during a walk"""
     if current_user["role"] != "walker":
         raise HTTPException(status_code=403, detail="Solo paseadores pueden crear reportes")
     
-    profile = await db.walkers.find_one({"user_id": current_user["id"]}, {"_id": 0})
     if not profile:
         raise HTTPException(status_code=404, detail="Perfil de paseador no encontrado")
     
@@ -2851,14 +4173,13 @@ async def create_wellness_report(
     mood_emojis = {"happy": "😊", "calm": "😌", "tired": "😴", "anxious": "😰"}
     mood_text = mood_emojis.get(report_data.mood, "🐕")
     
-    notification = Notification(
-        user_id=booking["owner_id"],
+    await dispatch_notification(
+        users=[booking["owner_id"]],
         type="wellness_report",
         title=f"Reporte de {pet.get('name', 'tu mascota') if pet else 'tu mascota'}",
         message=f"{mood_text} {pet.get('name', 'Tu mascota') if pet else 'Tu mascota'} está {report_data.mood}. {report_data.notes[:50]}{'...' if len(report_data.notes) > 50 else ''}",
         data={"report_id": report.id, "booking_id": report_data.booking_id, "has_photos": len(report_data.photos) > 0}
     )
-    await db.notifications.insert_one(notification.model_dump())
     
     return report.model_dump()
 
@@ -2866,6 +4187,10 @@ async def create_wellness_report(
 async def get_wellness_reports(booking_id: str, current_user: dict = Depends(get_current_user)):
     """Get all wellness reports for a booking"""
     reports = await db.wellness_reports.find({"booking_id": booking_id}, {"_id": 0}).sort("created_at", -1).to_list(50)
+    if reports:
+        walk_summary = await get_walk_summary(booking_id)
+        for report in reports:
+            report["walk_summary"] = walk_summary
     return reports
 
 @api_router.get("/wellness-reports/{report_id}")
@@ -2935,6 +4260,7 @@ async def upload_photo(
             {"id": photo_data.entity_id},
             {"$push": {"gallery_images": photo.id}}
         )
+    invalidate_provider_profile(current_user["id"])
     
     return {"photo_id": photo.id, "message": "Foto subida exitosamente"}
 
@@ -2974,76 +4300,266 @@ async def delete_photo(photo_id: str, current_user: dict = Depends(get_current_u
             {"id": photo["entity_id"]},
             {"$pull": {"gallery_images": photo_id}}
         )
+        invalidate_provider_profile(current_user["id"])
     
     return {"message": "Foto eliminada"}
 
 # ============= NOTIFICATIONS ENDPOINTS =============
 
-@api_router.get("/notifications")
-async def get_notifications(current_user: dict = Depends(get_current_user)):
-    """Get user notifications"""
-    user_id = current_user["id"]
-    
-    if current_user["role"] in ["walker", "daycare"]:
-        collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-        if profile:
-            notifications = await db.notifications.find({
-                "$or": [{"user_id": user_id}, {"user_id": profile["id"]}]
-            }, {"_id": 0}).sort("created_at", -1).to_list(50)
+NOTIFICATION_PAGE_SIZE = 50
+NOTIFICATION_MAX_PAGE_SIZE = 100
+# Read notifications are deleted by a TTL index this long after being read;
+# unread ones are kept (see archive_notifications.py for those)
+NOTIFICATION_READ_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_READ_RETENTION_DAYS", 90))
+
+async def ensure_notification_retention():
+    """TTL index on read_at, limited to read notifications"""
+    expire_after = NOTIFICATION_READ_RETENTION_DAYS * 24 * 3600
+    try:
+        await db.notifications.create_index(
+            "read_at",
+            name="read_at_ttl",
+            expireAfterSeconds=expire_after,
+            partialFilterExpression={"read": True}
+        )
+    except OperationFailure:
+        # Retention changed since the index was built
+        await db.command("collMod", "notifications", index={"name": "read_at_ttl", "expireAfterSeconds": expire_after})
+
+# recipient id -> {"unread", "version"}; refreshed whenever this process
+# changes a counter, so an unchanged poll is answered from memory
+notification_counter_cache = TTLCache(
+    max_size=int(os.environ.get("NOTIFICATION_COUNTER_CACHE_MAX_SIZE", 20000)),
+    ttl_seconds=float(os.environ.get("NOTIFICATION_COUNTER_CACHE_TTL_SECONDS", 30))
+)
+
+async def adjust_notification_counters(increments: Dict[str, int]) -> None:
+    """$inc each recipient's unread counter and bump its version. A counter
+    created here isn't seeded; load_notification_counter recounts it."""
+    if not increments:
+        return
+    await db.notification_counters.bulk_write([
+        UpdateOne({"recipient_id": recipient_id}, {"$inc": {"unread": delta, "version": 1}}, upsert=True)
+        for recipient_id, delta in increments.items()
+    ], ordered=False)
+    for recipient_id in increments:
+        notification_counter_cache.invalidate(recipient_id)
+
+async def count_stored_notifications(docs: List[dict]) -> None:
+    """Write-behind hook: a notification only counts as unread once stored"""
+    increments: Dict[str, int] = {}
+    for doc in docs:
+        if not doc.get("read"):
+            increments[doc["user_id"]] = increments.get(doc["user_id"], 0) + 1
+    await adjust_notification_counters(increments)
+
+write_behind.register("notifications", count_stored_notifications)
+
+async def create_notifications(notifications: List[Notification]) -> None:
+    """Queue notifications for storage; their recipients' unread counters
+    are bumped once the batch is written. Every notification write goes
+    through here so the counters stay exact."""
+    await write_behind.add("notifications", [n.model_dump() for n in notifications])
+
+# provider profile id -> owning user id; the link never changes
+profile_user_cache = TTLCache(
+    max_size=int(os.environ.get("PROFILE_USER_CACHE_MAX_SIZE", 10000)),
+    ttl_seconds=float(os.environ.get("PROFILE_USER_CACHE_TTL_SECONDS", 3600))
+)
+
+async def resolve_provider_users(profile_ids: List[str]) -> List[str]:
+    """User ids behind walker/daycare/vet profile ids"""
+    user_ids = []
+    missing = []
+    for profile_id in profile_ids:
+        user_id = profile_user_cache.get(profile_id)
+        if user_id:
+            user_ids.append(user_id)
         else:
-            notifications = await db.notifications.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(50)
-    else:
-        notifications = await db.notifications.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(50)
+            missing.append(profile_id)
+    if missing:
+        found = await asyncio.gather(*[
+            db[collection].find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "user_id": 1}).to_list(len(missing))
+            for collection in set(PROVIDER_COLLECTIONS.values())
+        ])
+        for profiles in found:
+            for profile in profiles:
+                profile_user_cache.set(profile["id"], profile["user_id"])
+                user_ids.append(profile["user_id"])
+    return user_ids
+
+async def dispatch_notification(
+    type: str,
+    title: str,
+    message: str,
+    data: Optional[Dict[str, Any]] = None,
+    users: Optional[List[str]] = None,
+    providers: Optional[List[str]] = None,
+    roles: Optional[List[str]] = None
+) -> int:
+    """Notify users, provider profiles and/or whole roles.
+
+    Every target is resolved to user ids here, at write time, so each
+    notification is stored under the user who reads it and the feed is a
+    plain user_id query. Returns how many notifications were written.
+    """
+    recipients = list(users or [])
+    if providers:
+        recipients += await resolve_provider_users(providers)
+    if roles:
+        members = await db.users.find({"role": {"$in": roles}}, {"_id": 0, "id": 1}).to_list(None)
+        recipients += [member["id"] for member in members]
+    
+    recipients = list(dict.fromkeys(recipients))
+    await create_notifications([
+        Notification(user_id=user_id, type=type, title=title, message=message, data=data or {})
+        for user_id in recipients
+    ])
+    return len(recipients)
+
+NOTIFICATION_SEED_ATTEMPTS = 5
+
+async def seed_notification_counter(recipient_id: str) -> dict:
+    """Set a recipient's unread counter from the notifications collection.
+
+    Every counter change happens after the notification write it accounts
+    for and bumps `version`, so the seed is written only if the version is
+    unchanged since before the count: a change that overlapped the count
+    makes it retry instead of counting a notification twice or losing it.
+    """
+    counter = await db.notification_counters.find_one_and_update(
+        {"recipient_id": recipient_id},
+        {"$setOnInsert": {"unread": 0, "version": 0}},
+        upsert=True,
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    for _ in range(NOTIFICATION_SEED_ATTEMPTS):
+        if counter.get("seeded"):
+            break
+        unread = await db.notifications.count_documents({"user_id": recipient_id, "read": False})
+        seeded = await db.notification_counters.find_one_and_update(
+            {"recipient_id": recipient_id, "version": counter["version"]},
+            {"$set": {"unread": unread, "seeded": True}, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if seeded:
+            return seeded
+        counter = await db.notification_counters.find_one({"recipient_id": recipient_id}, {"_id": 0})
+    return counter
+
+async def load_notification_counter(recipient_id: str) -> dict:
+    counter = notification_counter_cache.get(recipient_id)
+    if counter is not None:
+        return counter
+    
+    counter = await db.notification_counters.find_one({"recipient_id": recipient_id}, {"_id": 0})
+    if counter is None or not counter.get("seeded"):
+        # No counter yet, or one first created by an $inc that only counts
+        # notifications since (e.g. recipients from before counters existed)
+        counter = await seed_notification_counter(recipient_id)
+        if not counter.get("seeded"):
+            return counter  # kept busy by writes; try seeding again next read
+    notification_counter_cache.set(recipient_id, counter)
+    return counter
+
+async def rebuild_notification_counters() -> int:
+    """Recompute every unread counter from the notifications collection"""
+    rows = await db.notifications.aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ]).to_list(None)
+    
+    recipient_ids = [row["_id"] for row in rows]
+    if rows:
+        await db.notification_counters.bulk_write([
+            UpdateOne(
+                {"recipient_id": row["_id"]},
+                {"$set": {"unread": row["unread"], "seeded": True}, "$inc": {"version": 1}},
+                upsert=True
+            )
+            for row in rows
+        ], ordered=False)
+    await db.notification_counters.update_many(
+        {"recipient_id": {"$nin": recipient_ids}},
+        {"$set": {"unread": 0, "seeded": True}, "$inc": {"version": 1}}
+    )
+    notification_counter_cache.clear()
+    return len(rows)
+
+@api_router.get("/notifications")
+async def get_notifications(
+    response: Response,
+    before: Optional[str] = None,
+    unread: bool = False,
+    limit: int = Query(NOTIFICATION_PAGE_SIZE, ge=1, le=NOTIFICATION_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get user notifications, newest first.
+
+    Keyset paged over (created_at, id): when more remain, the X-Next-Cursor
+    header holds the value to pass as `before` for the next page.
+    """
+    query: Dict[str, Any] = {"user_id": current_user["id"]}
+    if unread:
+        query["read"] = False
+    if before:
+        created_at, notification_id = decode_cursor(before, 2)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": notification_id}}
+        ]
+    
+    notifications = await db.notifications.find(query, {"_id": 0, "read_at": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
     
+    if len(notifications) > limit:
+        notifications = notifications[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(notifications[-1]["created_at"], notifications[-1]["id"])
     return notifications
 
 @api_router.get("/notifications/unread/count")
-async def get_notification_count(current_user: dict = Depends(get_current_user)):
-    """Get unread notifications count"""
-    user_id = current_user["id"]
-    
-    if current_user["role"] in ["walker", "daycare"]:
-        collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-        if profile:
-            count = await db.notifications.count_documents({
-                "$or": [{"user_id": user_id}, {"user_id": profile["id"]}],
-                "read": False
-            })
-        else:
-            count = await db.notifications.count_documents({"user_id": user_id, "read": False})
-    else:
-        count = await db.notifications.count_documents({"user_id": user_id, "read": False})
+async def get_notification_count(request: Request, claims: dict = Depends(get_token_claims)):
+    """Get unread notifications count.
+
+    Read from the per-recipient counters, with an ETag over their versions:
+    a poll with a matching If-None-Match gets a 304, and while the counters
+    are cached that costs no database round trip.
+    """
+    counter = await load_notification_counter(claims["id"])
+    tag = f"{claims['id']}:{counter['version']}"
+    etag = '"' + hashlib.sha1(tag.encode()).hexdigest() + '"'
     
-    return {"unread_count": count}
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"unread_count": max(counter["unread"], 0)}, headers=headers)
 
 @api_router.post("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
     """Mark a notification as read"""
-    await db.notifications.update_one(
-        {"id": notification_id},
-        {"$set": {"read": True}}
+    notification = await db.notifications.find_one_and_update(
+        {"id": notification_id, "user_id": current_user["id"], "read": False},
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "user_id": 1}
     )
+    if notification:
+        await adjust_notification_counters({notification["user_id"]: -1})
     return {"message": "Notificación marcada como leída"}
 
 @api_router.post("/notifications/read-all")
 async def mark_all_notifications_read(current_user: dict = Depends(get_current_user)):
     """Mark all notifications as read"""
-    user_id = current_user["id"]
-    
-    if current_user["role"] in ["walker", "daycare"]:
-        collection = "walkers" if current_user["role"] == "walker" else "daycares"
-        profile = await db[collection].find_one({"user_id": current_user["id"]}, {"_id": 0})
-        if profile:
-            await db.notifications.update_many(
-                {"$or": [{"user_id": user_id}, {"user_id": profile["id"]}]},
-                {"$set": {"read": True}}
-            )
-        else:
-            await db.notifications.update_many({"user_id": user_id}, {"$set": {"read": True}})
-    else:
-        await db.notifications.update_many({"user_id": user_id}, {"$set": {"read": True}})
+    result = await db.notifications.update_many(
+        {"user_id": current_user["id"], "read": False},
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
+    )
+    # Decrement by what was actually flipped rather than resetting to 0,
+    # so a notification created meanwhile stays counted
+    if result.modified_count:
+        await adjust_notification_counters({current_user["id"]: -result.modified_count})
     
     return {"message": "Todas las notificaciones marcadas como leídas"}
 
@@ -3056,6 +4572,7 @@ app.add_middleware(
     allow_origin_regex="https?://.*",
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 logging.basicConfig(
@@ -3114,19 +4631,15 @@ async def upload_image(
 # ============= PROVIDER UNIFIED ENDPOINTS =============
 
 @api_router.get("/providers/me/profile")
-async def get_my_provider_profile(current_user: dict = Depends(get_current_user)):
+async def get_my_provider_profile(
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
+):
     """Get the full profile for the current logged-in provider"""
     role = current_user.get("role")
-    if role not in ["walker", "daycare", "vet"]:
+    if role not in PROVIDER_COLLECTIONS:
         raise HTTPException(status_code=403, detail="No eres un proveedor")
     
-    collection_name = {
-        "walker": "walkers",
-        "daycare": "daycares",
-        "vet": "vets"
-    }[role]
-    
-    profile = await db[collection_name].find_one({"user_id": current_user["id"]}, {"_id": 0})
     if not profile:
         raise HTTPException(status_code=404, detail="Perfil de proveedor no encontrado")
     return profile
@@ -3138,11 +4651,7 @@ async def update_provider_status(
 ):
     """Toggle active status or update capacity/radius"""
     role = current_user.get("role")
-    collection_name = {
-        "walker": "walkers",
-        "daycare": "daycares",
-        "vet": "vets"
-    }.get(role)
+    collection_name = PROVIDER_COLLECTIONS.get(role)
     
     if not collection_name:
         raise HTTPException(status_code=403, detail="No autorizado")
@@ -3164,6 +4673,7 @@ async def update_provider_status(
         {"user_id": current_user["id"]},
         {"$set": update_fields}
     )
+    invalidate_provider_profile(current_user["id"])
     return {"message": "Estado actualizado", "updates": update_fields}
 
 @api_router.patch("/providers/me/profile")
@@ -3173,11 +4683,7 @@ async def update_provider_profile(
 ):
     """Update detailed profile fields (Bio, Rates, etc)"""
     role = current_user.get("role")
-    collection_name = {
-        "walker": "walkers",
-        "daycare": "daycares",
-        "vet": "vets"
-    }.get(role)
+    collection_name = PROVIDER_COLLECTIONS.get(role)
     
     if not collection_name:
         raise HTTPException(status_code=403, detail="No autorizado")
@@ -3196,6 +4702,7 @@ async def update_provider_profile(
         {"user_id": current_user["id"]},
         {"$set": data}
     )
+    invalidate_provider_profile(current_user["id"])
     return {"message": "Perfil actualizado", "data": data}
 
 # ============= PIN VERIFICATION & GPS TRACKING =============
@@ -3238,14 +4745,13 @@ async def generate_verification_pin(
     )
     
     # Notify walker that PIN is ready
-    notification = Notification(
-        user_id=booking["service_id"],
+    await dispatch_notification(
+        providers=[booking["service_id"]],
         type="pin_ready",
         title="PIN de Verificación Listo",
         message=f"El dueño ha generado el PIN. Solicítalo cuando llegues para iniciar el paseo.",
         data={"booking_id": booking_id}
     )
-    await db.notifications.insert_one(notification.model_dump())
     
     return {
         "pin": pin,
@@ -3267,7 +4773,7 @@ async def verify_pin_and_start(
     # Check if walker is the provider
     if booking["service_id"] != current_user.get("id") and current_user.get("role") != "admin":
         # Also check by user_id in walkers collection
-        walker = await db.walkers.find_one({"user_id": current_user["id"]})
+        walker = await load_provider_profile(current_user)
         if not walker or walker["id"] != booking["service_id"]:
             raise HTTPException(status_code=403, detail="Solo el paseador asignado puede verificar el PIN")
     
@@ -3281,26 +4787,23 @@ async def verify_pin_and_start(
         return {"success": True, "message": "PIN ya verificado. El paseo está en curso.", "already_started": True}
     
     # PIN verified - start the walk with GPS tracking
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {
-            "status": "in_progress",
-            "pin_verified_at": datetime.now(timezone.utc).isoformat(),
-            "started_at": datetime.now(timezone.utc).isoformat(),
-            "gps_tracking_enabled": True,
-            "location_history": []
-        }}
-    )
+    verified_at = datetime.now(timezone.utc).isoformat()
+    await apply_booking_update(booking_id, {
+        "status": "in_progress",
+        "pin_verified_at": verified_at,
+        "started_at": verified_at,
+        "gps_tracking_enabled": True
+    })
+    await update_safety_state(booking_id, set_fields={"pin_verified": True, "pin_verified_at": verified_at})
     
     # Notify owner that walk has started
-    notification = Notification(
-        user_id=booking["owner_id"],
+    await dispatch_notification(
+        users=[booking["owner_id"]],
         type="walk_started",
         title="¡Paseo Iniciado!",
         message=f"El paseador ha verificado el PIN. Ahora puedes seguir el paseo en tiempo real.",
         data={"booking_id": booking_id}
     )
-    await db.notifications.insert_one(notification.model_dump())
     
     return {
         "success": True,
@@ -3314,6 +4817,615 @@ class LocationUpdate(BaseModel):
     accuracy: Optional[float] = None
     speed: Optional[float] = None
 
+LIVE_MAX_PENDING_POINTS = 50
+
+class LiveSubscriber:
+    """Outbound frames for one live socket.
+
+    Consecutive "location" frames waiting for a slow client are merged into
+    one carrying the newest position and at most LIVE_MAX_PENDING_POINTS
+    trail points, so a stalled socket never buffers a backlog of stale
+    points. Every other frame (status, safety) is kept in order and never
+    dropped; there are only a handful per walk.
+    """
+
+    def __init__(self):
+        self._frames: deque = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, message: dict) -> int:
+        """Queue a frame; returns how many trail points were coalesced away"""
+        dropped = 0
+        pending = self._frames[-1] if self._frames else None
+        if message.get("type") == "location" and pending is not None and pending.get("type") == "location":
+            points = pending["points"] + message["points"]
+            dropped = max(len(points) - LIVE_MAX_PENDING_POINTS, 0)
+            self._frames[-1] = {**message, "points": points[dropped:]}
+        else:
+            self._frames.append(message)
+        self._ready.set()
+        return dropped
+
+    async def get(self) -> dict:
+        # Safe to cancel: a frame is only removed once nothing awaits
+        while not self._frames:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._frames.popleft()
+
+class LocationHub:
+    """In-process pub/sub of live walk updates, keyed by booking id.
+
+    Subscribers only see updates ingested by this server process.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, set] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, booking_id: str) -> LiveSubscriber:
+        subscriber = LiveSubscriber()
+        self._subscribers.setdefault(booking_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, booking_id: str, subscriber: LiveSubscriber) -> None:
+        subscribers = self._subscribers.get(booking_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[booking_id]
+
+    def publish(self, booking_id: str, message: dict) -> None:
+        for subscriber in self._subscribers.get(booking_id, ()):
+            self.dropped += subscriber.put(message)
+            self.published += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "bookings": len(self._subscribers),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "published": self.published,
+            "dropped_points": self.dropped
+        }
+
+location_hub = LocationHub()
+
+async def publish_booking_status(booking_id: str, before: dict, update_data: dict) -> None:
+    """Booking update hook: tell live subscribers about status changes"""
+    if "status" in update_data:
+        location_hub.publish(booking_id, {"type": "status", "booking_id": booking_id, "status": update_data["status"]})
+LIVE_HEARTBEAT_SECONDS = 25
+
+# Streaming safety checks on GPS ingest
+MAX_PLAUSIBLE_SPEED_MPS = 15.0  # ~54 km/h; faster than this between fixes is a jump
+JUMP_MIN_DISTANCE_M = 150.0  # ignore jitter-sized "jumps" between close fixes
+STATIONARY_RADIUS_M = 30.0
+STATIONARY_ALERT_SECONDS = 15 * 60
+GPS_STABLE_FIXES = 5  # consistent fixes after a jump before gps_jump is cleared
+WALK_STATE_IDLE_SECONDS = 3 * 3600
+
+def coordinates_of(value: Any) -> Optional[dict]:
+    """{lat, lng} from a stored coordinates field, None when missing or malformed"""
+    if not isinstance(value, dict):
+        return None
+    lat, lng = value.get("lat"), value.get("lng")
+    if not isinstance(lat, (int, float)) or not isinstance(lng, (int, float)):
+        return None
+    return {"lat": float(lat), "lng": float(lng)}
+
+class WalkState:
+    """What the detector remembers about one in-progress walk"""
+
+    def __init__(self, booking: dict, radius_km: float, center: Optional[dict] = None):
+        # The service area is centred on the pickup point, else on `center`
+        # (the walk's first stored fix); with neither, the first fix seen
+        self.center = coordinates_of(booking.get("pickup_coordinates")) or center
+        self.radius_m = radius_km * 1000
+        self.last_fix: Optional[dict] = None
+        self.anchor: Optional[dict] = None  # where the walker has been standing since
+        self.outside = False
+        self.stationary = False
+        self.jumped = False
+        self.consistent_fixes = 0
+        self.touched = time_module.monotonic()
+
+class WalkMonitor:
+    """Incremental geofence/stationary/jump detector fed by the ingest path.
+
+    Keeps per-booking state in memory so each fix costs O(1); state is
+    rebuilt from the booking after a restart, anchored at the next fix.
+    Emits events only on transitions (leaving the area, stopping too long,
+    GPS settling after a jump) and for each implausible jump.
+    """
+
+    def __init__(self):
+        self._states: Dict[str, WalkState] = {}
+
+    async def _state(self, booking_id: str) -> Optional[WalkState]:
+        state = self._states.get(booking_id)
+        if state is None:
+            booking = await db.bookings.find_one(
+                {"id": booking_id},
+                {"_id": 0, "service_id": 1, "pickup_coordinates": 1}
+            )
+            if not booking:
+                return None
+            walker = await db.walkers.find_one({"id": booking["service_id"]}, {"_id": 0, "radius_km": 1})
+            first_fix = None
+            if not coordinates_of(booking.get("pickup_coordinates")):
+                first_fix = await db.location_fixes.find_one(
+                    {"booking_id": booking_id}, {"_id": 0, "lat": 1, "lng": 1}, sort=[("ts", 1)]
+                )
+            state = WalkState(booking, (walker or {}).get("radius_km") or 5.0, coordinates_of(first_fix))
+            self._states[booking_id] = state
+            self._evict_idle()
+        state.touched = time_module.monotonic()
+        return state
+
+    def _evict_idle(self) -> None:
+        cutoff = time_module.monotonic() - WALK_STATE_IDLE_SECONDS
+        for booking_id in [b for b, st in self._states.items() if st.touched < cutoff]:
+            del self._states[booking_id]
+
+    def discard(self, booking_id: str) -> None:
+        self._states.pop(booking_id, None)
+
+    async def process(self, booking_id: str, fixes: List[dict]) -> List[dict]:
+        """Feed time-ordered fixes; returns the safety events they raise"""
+        state = await self._state(booking_id)
+        if state is None:
+            return []
+        events = []
+        for fix in fixes:
+            events.extend(self._step(state, fix))
+        for event in events:
+            event["booking_id"] = booking_id
+        return events
+
+    def _step(self, state: WalkState, fix: dict) -> List[dict]:
+        events = []
+        at = {"lat": fix["lat"], "lng": fix["lng"], "ts": fix["ts"].isoformat()}
+        
+        last = state.last_fix
+        if last is not None:
+            elapsed = (fix["ts"] - last["ts"]).total_seconds()
+            if elapsed <= 0:
+                return events  # out of order or duplicate
+            moved = float(haversine_m(last["lat"], last["lng"], fix["lat"], fix["lng"]))
+            if moved > JUMP_MIN_DISTANCE_M and moved / elapsed > MAX_PLAUSIBLE_SPEED_MPS:
+                # Keep measuring from the last plausible fix
+                events.append({"type": "impossible_jump", **at, "distance_m": round(moved, 1),
+                               "speed_mps": round(moved / elapsed, 1)})
+                state.jumped = True
+                state.consistent_fixes = 0
+                return events
+        state.last_fix = fix
+        if state.center is None:
+            state.center = {"lat": fix["lat"], "lng": fix["lng"]}
+        
+        if state.jumped:
+            state.consistent_fixes += 1
+            if state.consistent_fixes >= GPS_STABLE_FIXES:
+                state.jumped = False
+                events.append({"type": "gps_stable", **at})
+        
+        if state.center is not None:
+            from_center = float(haversine_m(state.center["lat"], state.center["lng"], fix["lat"], fix["lng"]))
+            if from_center > state.radius_m and not state.outside:
+                state.outside = True
+                events.append({"type": "left_service_area", **at, "distance_m": round(from_center, 1),
+                               "radius_m": state.radius_m})
+            elif from_center <= state.radius_m and state.outside:
+                state.outside = False
+                events.append({"type": "returned_to_service_area", **at})
+        
+        if state.anchor is None or float(haversine_m(state.anchor["lat"], state.anchor["lng"], fix["lat"], fix["lng"])) > STATIONARY_RADIUS_M:
+            state.anchor = fix
+            if state.stationary:
+                state.stationary = False
+                events.append({"type": "moving_again", **at})
+        elif not state.stationary and (fix["ts"] - state.anchor["ts"]).total_seconds() >= STATIONARY_ALERT_SECONDS:
+            state.stationary = True
+            events.append({"type": "stationary", **at,
+                           "since": state.anchor["ts"].isoformat()})
+        return events
+
+walk_monitor = WalkMonitor()
+
+async def stop_walk_monitor(booking_id: str, before: dict, update_data: dict) -> None:
+    """Booking update hook: forget a walk's monitor state once it stops"""
+    if "status" in update_data and update_data["status"] != "in_progress":
+        walk_monitor.discard(booking_id)
+
+# Events that set/clear a flag on the booking, and which ones alert the owner
+SAFETY_FLAG_EVENTS = {
+    "left_service_area": ("outside_service_area", True),
+    "returned_to_service_area": ("outside_service_area", False),
+    "stationary": ("stationary", True),
+    "moving_again": ("stationary", False),
+    "impossible_jump": ("gps_jump", True),
+    "gps_stable": ("gps_jump", False)
+}
+SAFETY_ALERT_MESSAGES = {
+    "left_service_area": ("Paseo fuera de zona", "El paseador salió del área de servicio."),
+    "stationary": ("Paseo detenido", "El paseador lleva más de 15 minutos sin moverse.")
+}
+
+async def record_safety_events(booking_id: str, events: List[dict]) -> None:
+    """Persist detector events, update booking flags and alert the owner"""
+    if not events:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    flags = {}
+    for event in events:
+        flag, active = SAFETY_FLAG_EVENTS[event["type"]]
+        flags[f"safety_flags.{flag}"] = {"active": active, "updated_at": event["ts"], "lat": event["lat"], "lng": event["lng"]}
+    
+    writes = [
+        write_behind.add("safety_events", [{"id": str(uuid.uuid4()), "created_at": now, **event} for event in events]),
+        db.bookings.update_one({"id": booking_id}, {"$set": flags}),
+        update_safety_state(booking_id, set_fields=flags)
+    ]
+    alerting = [event for event in events if event["type"] in SAFETY_ALERT_MESSAGES]
+    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0, "owner_id": 1}) if alerting else None
+    alerts = [
+        Notification(
+            user_id=booking["owner_id"],
+            type="safety_alert",
+            title=SAFETY_ALERT_MESSAGES[event["type"]][0],
+            message=SAFETY_ALERT_MESSAGES[event["type"]][1],
+            data={"booking_id": booking_id, "event": event["type"]}
+        )
+        for event in alerting
+    ] if booking else []
+    if alerts:
+        writes.append(create_notifications(alerts))
+    await asyncio.gather(*writes)
+    
+    for event in events:
+        location_hub.publish(booking_id, {**event, "type": "safety", "event": event["type"]})
+
+class LocationFix(LocationUpdate):
+    timestamp: str  # client-side ISO time the fix was taken
+
+class LocationBatch(BaseModel):
+    fixes: List[LocationFix]
+
+MAX_LOCATION_BATCH = 500
+# Phone GPS reports accuracy in meters; beyond this the fix is useless for a walk trail
+MAX_FIX_ACCURACY_M = 500.0
+# Client clocks drift; fixes stamped further ahead than this are rejected
+MAX_FIX_CLOCK_SKEW = timedelta(minutes=5)
+
+def clean_location_batch(fixes: List[LocationFix]) -> List[dict]:
+    """Turn a client batch into storable fixes: drop unparseable or
+    future timestamps, impossible coordinates/accuracy, and repeats of a
+    timestamp already seen (retried uploads resend the same points)"""
+    latest_allowed = datetime.now(timezone.utc) + MAX_FIX_CLOCK_SKEW
+    seen = set()
+    cleaned = []
+    for fix in fixes:
+        try:
+            ts = datetime.fromisoformat(fix.timestamp.replace('Z', '+00:00'))
+        except ValueError:
+            continue
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        # BSON dates keep milliseconds; truncate so repeats compare equal to stored fixes
+        ts = ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+        if ts > latest_allowed or ts in seen:
+            continue
+        if not (-90 <= fix.lat <= 90 and -180 <= fix.lng <= 180):
+            continue
+        if fix.accuracy is not None and not (0 < fix.accuracy <= MAX_FIX_ACCURACY_M):
+            continue
+        seen.add(ts)
+        cleaned.append({
+            "lat": fix.lat,
+            "lng": fix.lng,
+            "accuracy": fix.accuracy,
+            "speed": fix.speed,
+            "ts": ts
+        })
+    return cleaned
+
+async def ensure_location_fixes_collection():
+    """GPS fixes live in a time-series collection (MongoDB 5.0+) bucketed
+    per booking, instead of an ever-growing array on the booking"""
+    try:
+        await db.create_collection(
+            "location_fixes",
+            timeseries={"timeField": "ts", "metaField": "booking_id", "granularity": "seconds"}
+        )
+    except CollectionInvalid:
+        pass  # already exists
+    await db.location_fixes.create_index([("booking_id", 1), ("ts", 1)])
+
+def location_fix_to_point(fix: dict) -> dict:
+    """API shape of a stored fix (the format location_history used)"""
+    ts = fix["ts"]
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return {
+        "lat": fix["lat"],
+        "lng": fix["lng"],
+        "accuracy": fix.get("accuracy"),
+        "speed": fix.get("speed"),
+        "timestamp": ts.isoformat()
+    }
+
+async def record_location_fixes(booking_id: str, fixes: List[dict]) -> None:
+    """Store GPS fixes ({lat, lng, accuracy, speed, ts}) for a booking and
+    move walker_current_location to the newest one"""
+    if not fixes:
+        return
+    await db.location_fixes.insert_many(
+        [{**fix, "booking_id": booking_id} for fix in fixes],
+        ordered=False
+    )
+    latest = max(fixes, key=lambda fix: fix["ts"])
+    latest_at = latest["ts"].isoformat()
+    # A late upload of an older buffered batch must not move the marker back
+    await db.bookings.update_one(
+        {"id": booking_id, "$or": [
+            {"last_location_at": {"$exists": False}},
+            {"last_location_at": {"$lt": latest_at}}
+        ]},
+        {"$set": {
+            "walker_current_location": {"lat": latest["lat"], "lng": latest["lng"]},
+            "last_location_at": latest_at
+        }}
+    )
+    
+    invalidate_shared_trip(booking_id)
+    
+    ordered = sorted(fixes, key=lambda fix: fix["ts"])
+    await record_safety_events(booking_id, await walk_monitor.process(booking_id, ordered))
+    
+    location_hub.publish(booking_id, {
+        "type": "location",
+        "booking_id": booking_id,
+        "current_location": {"lat": latest["lat"], "lng": latest["lng"]},
+        "points": [location_fix_to_point(fix) for fix in ordered]
+    })
+
+async def load_route(booking_id: str, last: Optional[int] = None) -> List[dict]:
+    """A booking's fixes in time order; only the newest `last` if given"""
+    projection = {"_id": 0, "booking_id": 0}
+    if last:
+        fixes = await db.location_fixes.find({"booking_id": booking_id}, projection).sort("ts", -1).limit(last).to_list(last)
+        fixes.reverse()
+    else:
+        fixes = await db.location_fixes.find({"booking_id": booking_id}, projection).sort("ts", 1).to_list(None)
+    return [location_fix_to_point(fix) for fix in fixes]
+
+EARTH_RADIUS_M = 6371000.0
+
+def project_to_meters(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """Equirectangular projection around the route's first point; accurate
+    to well under a meter over the few km of a walk"""
+    lat_rad, lng_rad = np.radians(lat), np.radians(lng)
+    x = EARTH_RADIUS_M * (lng_rad - lng_rad[0]) * np.cos(lat_rad[0])
+    y = EARTH_RADIUS_M * (lat_rad - lat_rad[0])
+    return np.column_stack([x, y])
+
+def douglas_peucker(xy: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """Boolean mask of the points Douglas–Peucker keeps at tolerance_m.
+    Iterative, with each segment's distances computed in one NumPy pass."""
+    n = len(xy)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = xy[start], xy[end]
+        inner = xy[start + 1:end]
+        ab = b - a
+        length = np.hypot(ab[0], ab[1])
+        if length == 0:
+            # Closed loop (walk back to the start): distance to the point itself
+            distances = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            distances = np.abs(ab[0] * (inner[:, 1] - a[1]) - ab[1] * (inner[:, 0] - a[0])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+def encode_polyline(lat: np.ndarray, lng: np.ndarray) -> str:
+    """Google encoded polyline (precision 5), as decoded by Leaflet/Google Maps plugins"""
+    coords = np.round(np.column_stack([lat, lng]) * 1e5).astype(np.int64)
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+def build_route_payload(points: List[dict], encoding: str, tolerance_m: float, timestamps: bool) -> dict:
+    """Simplified route as raw points or an encoded polyline; timestamps
+    go out as the first fix's epoch ms plus per-point deltas"""
+    if not points:
+        kept = []
+    elif tolerance_m > 0 and len(points) > 2:
+        lat = np.array([p["lat"] for p in points])
+        lng = np.array([p["lng"] for p in points])
+        mask = douglas_peucker(project_to_meters(lat, lng), tolerance_m)
+        kept = [point for point, keep in zip(points, mask.tolist()) if keep]
+    else:
+        kept = points
+    
+    payload = {"count": len(kept), "original_count": len(points), "tolerance_m": tolerance_m}
+    if encoding == "points":
+        payload["points"] = kept
+        return payload
+    
+    payload["encoding"] = "polyline5"
+    payload["polyline"] = encode_polyline(
+        np.array([p["lat"] for p in kept], dtype=float),
+        np.array([p["lng"] for p in kept], dtype=float)
+    ) if kept else ""
+    if timestamps and kept:
+        epoch_ms = np.array(
+            [int(datetime.fromisoformat(p["timestamp"]).timestamp() * 1000) for p in kept],
+            dtype=np.int64
+        )
+        payload["timestamps"] = {
+            "start_ms": int(epoch_ms[0]),
+            "deltas_ms": np.diff(epoch_ms).tolist()
+        }
+    return payload
+
+# Below this segment speed (m/s) the dog is considered stopped; GPS jitter
+# alone produces ~0.2-0.4 m/s on a stationary phone
+MOVING_SPEED_MPS = 0.5
+
+def haversine_m(lat1: np.ndarray, lng1: np.ndarray, lat2: np.ndarray, lng2: np.ndarray) -> np.ndarray:
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+# Fixes reported less accurate than this (meters) stay in the trail but
+# are left out of the summary; their error alone exceeds a walker's steps
+SUMMARY_MAX_ACCURACY_M = 50.0
+
+# Fixes re-measured from the last plausible one per NumPy call after a jump
+JUMP_RECHECK_BLOCK = 32
+
+def plausible_fix_mask(lat: np.ndarray, lng: np.ndarray, t: np.ndarray, accuracy: np.ndarray) -> np.ndarray:
+    """Boolean mask dropping low-accuracy fixes and GPS jumps from a trail.
+
+    Like the walk monitor, each fix is measured from the last plausible
+    one. All consecutive segments are checked in one NumPy pass; only at
+    the rare bad ones are the following fixes re-measured from the fix
+    before the jump (a block at a time) until one is plausible again.
+    """
+    keep = ~(accuracy > SUMMARY_MAX_ACCURACY_M)  # NaN (no accuracy reported) is kept
+    idx = np.flatnonzero(keep)
+    if len(idx) < 2:
+        return keep
+    
+    def implausible(anchor: int, fixes: np.ndarray) -> np.ndarray:
+        elapsed = t[fixes] - t[anchor]
+        moved = haversine_m(lat[anchor], lng[anchor], lat[fixes], lng[fixes])
+        return (elapsed <= 0) | ((moved > JUMP_MIN_DISTANCE_M) & (moved > MAX_PLAUSIBLE_SPEED_MPS * elapsed))
+    
+    bad = implausible(idx[:-1], idx[1:])
+    resume = 0  # segments from here on start at a kept fix and are still valid
+    for segment in np.flatnonzero(bad).tolist():
+        if segment < resume:
+            continue
+        anchor, j = idx[segment], segment + 1
+        while j < len(idx):
+            block = idx[j:j + JUMP_RECHECK_BLOCK]
+            rejected = implausible(anchor, block)
+            dropped = len(block) if rejected.all() else int(np.argmin(rejected))
+            keep[block[:dropped]] = False
+            j += dropped
+            if dropped < len(block):
+                break
+        resume = j
+    return keep
+
+def summarize_walk(points: List[dict]) -> dict:
+    """Distance, moving/idle time, speeds and bounding box of a walk trail.
+
+    Computed over plausible fixes only, and distance counts moving segments
+    only, so jumps, poor fixes and jitter while stopped don't add meters.
+    """
+    empty = {"point_count": len(points), "dropped_point_count": len(points), "distance_m": 0.0,
+             "duration_s": 0, "moving_time_s": 0, "idle_time_s": 0,
+             "avg_speed_mps": 0.0, "max_speed_mps": 0.0, "bbox": None}
+    if not points:
+        return empty
+    
+    lat = np.array([p["lat"] for p in points], dtype=float)
+    lng = np.array([p["lng"] for p in points], dtype=float)
+    t = np.array([datetime.fromisoformat(p["timestamp"]).timestamp() for p in points])
+    accuracy = np.array([p.get("accuracy") for p in points], dtype=float)
+    
+    keep = plausible_fix_mask(lat, lng, t, accuracy)
+    if not keep.any():
+        return empty
+    lat, lng, t = lat[keep], lng[keep], t[keep]
+    
+    segment_m = haversine_m(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    segment_s = np.diff(t)
+    speed = segment_m / segment_s
+    moving = speed >= MOVING_SPEED_MPS
+    
+    moving_time = float(segment_s[moving].sum())
+    moving_distance = float(segment_m[moving].sum())
+    duration = float(t[-1] - t[0])
+    return {
+        "point_count": len(points),
+        "dropped_point_count": len(points) - int(keep.sum()),
+        "distance_m": round(moving_distance, 1),
+        "duration_s": int(duration),
+        "moving_time_s": int(moving_time),
+        "idle_time_s": int(duration - moving_time),
+        "avg_speed_mps": round(moving_distance / moving_time, 2) if moving_time else 0.0,
+        "max_speed_mps": round(float(speed.max()), 2) if len(speed) else 0.0,
+        "bbox": {
+            "min_lat": float(lat.min()), "min_lng": float(lng.min()),
+            "max_lat": float(lat.max()), "max_lng": float(lng.max())
+        }
+    }
+
+async def store_walk_summary(booking_id: str) -> dict:
+    """Compute the walk summary from the stored trail and persist it on the booking"""
+    summary = summarize_walk(await load_route(booking_id))
+    summary["computed_at"] = datetime.now(timezone.utc).isoformat()
+    await db.bookings.update_one({"id": booking_id}, {"$set": {"walk_summary": summary}})
+    return summary
+
+async def summarize_completed_walk(booking_id: str, before: dict, update_data: dict) -> None:
+    """Booking update hook: store the summary when a booking completes"""
+    if update_data.get("status") == "completed" and before.get("status") != "completed":
+        await store_walk_summary(booking_id)
+
+# Side effects of apply_booking_update, run in order after each booking
+# update that matched: hook(booking_id, booking_before, update_data)
+BOOKING_UPDATE_HOOKS = [
+    publish_booking_status,
+    stop_walk_monitor,
+    summarize_completed_walk,
+    sync_safety_state,
+    drop_shared_trip
+]
+
+# Routes of completed walks never change, so their payloads are cached
+route_cache = TTLCache(
+    max_size=int(os.environ.get("ROUTE_CACHE_MAX_SIZE", 1000)),
+    ttl_seconds=float(os.environ.get("ROUTE_CACHE_TTL_SECONDS", 3600))
+)
+
+async def get_tracked_booking(booking_id: str, claims: dict) -> dict:
+    """Booking whose GPS data the caller (owner or assigned walker) may see"""
+    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0, "location_history": 0})
+    if not booking:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
+    
+    # Only owner or walker can see location
+    if booking["owner_id"] != claims["id"]:
+        # Check if is the walker
+        if claims["role"] != "walker" or claims["profile_id"] != booking["service_id"]:
+            raise HTTPException(status_code=403, detail="No autorizado")
+    return booking
+
 @api_router.post("/bookings/{booking_id}/update-location")
 async def update_walker_location(
     booking_id: str,
@@ -3321,7 +5433,10 @@ async def update_walker_location(
     current_user: dict = Depends(get_current_user)
 ):
     """Walker updates their GPS location during the walk"""
-    booking = await db.bookings.find_one({"id": booking_id})
+    booking = await db.bookings.find_one(
+        {"id": booking_id},
+        {"_id": 0, "status": 1, "gps_tracking_enabled": 1}
+    )
     if not booking:
         raise HTTPException(status_code=404, detail="Reserva no encontrada")
     
@@ -3331,40 +5446,71 @@ async def update_walker_location(
     if not booking.get("gps_tracking_enabled"):
         raise HTTPException(status_code=400, detail="GPS tracking no está habilitado")
     
-    location_entry = {
+    await record_location_fixes(booking_id, [{
         "lat": location.lat,
         "lng": location.lng,
         "accuracy": location.accuracy,
         "speed": location.speed,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+        "ts": datetime.now(timezone.utc)
+    }])
     
-    await db.bookings.update_one(
+    return {"success": True, "location_recorded": True}
+
+@api_router.post("/bookings/{booking_id}/locations")
+async def upload_walker_locations(
+    booking_id: str,
+    batch: LocationBatch,
+    current_user: dict = Depends(get_current_user),
+    profile: Optional[dict] = Depends(get_current_provider_profile)
+):
+    """Walker uploads a buffered batch of GPS fixes in one request"""
+    if len(batch.fixes) > MAX_LOCATION_BATCH:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_LOCATION_BATCH} puntos por lote")
+    
+    booking = await db.bookings.find_one(
         {"id": booking_id},
-        {
-            "$set": {"walker_current_location": {"lat": location.lat, "lng": location.lng}},
-            "$push": {"location_history": location_entry}
-        }
+        {"_id": 0, "service_id": 1, "status": 1, "gps_tracking_enabled": 1}
     )
+    if not booking:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
     
-    return {"success": True, "location_recorded": True}
+    is_assigned_walker = bool(profile and profile["id"] == booking["service_id"])
+    if not is_assigned_walker and current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Solo el paseador asignado puede enviar ubicaciones")
+    
+    if booking.get("status") != "in_progress":
+        raise HTTPException(status_code=400, detail="El paseo no está activo")
+    
+    if not booking.get("gps_tracking_enabled"):
+        raise HTTPException(status_code=400, detail="GPS tracking no está habilitado")
+    
+    fixes = clean_location_batch(batch.fixes)
+    
+    # Drop points already stored by an earlier attempt of this upload
+    if fixes:
+        existing = await db.location_fixes.find(
+            {"booking_id": booking_id, "ts": {"$in": [fix["ts"] for fix in fixes]}},
+            {"_id": 0, "ts": 1}
+        ).to_list(len(fixes))
+        stored = {doc["ts"].replace(tzinfo=timezone.utc) if doc["ts"].tzinfo is None else doc["ts"] for doc in existing}
+        fixes = [fix for fix in fixes if fix["ts"] not in stored]
+    
+    await record_location_fixes(booking_id, fixes)
+    
+    return {
+        "success": True,
+        "received": len(batch.fixes),
+        "recorded": len(fixes),
+        "dropped": len(batch.fixes) - len(fixes)
+    }
 
 @api_router.get("/bookings/{booking_id}/live-location")
 async def get_live_location(
     booking_id: str,
-    current_user: dict = Depends(get_current_user)
+    claims: dict = Depends(get_token_claims)
 ):
     """Owner gets the current location of the walker"""
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Reserva no encontrada")
-    
-    # Only owner or walker can see location
-    if booking["owner_id"] != current_user["id"]:
-        # Check if is the walker
-        walker = await db.walkers.find_one({"user_id": current_user["id"]})
-        if not walker or walker["id"] != booking["service_id"]:
-            raise HTTPException(status_code=403, detail="No autorizado")
+    booking = await get_tracked_booking(booking_id, claims)
     
     return {
         "booking_id": booking_id,
@@ -3372,7 +5518,92 @@ async def get_live_location(
         "gps_tracking_enabled": booking.get("gps_tracking_enabled", False),
         "current_location": booking.get("walker_current_location"),
         "started_at": booking.get("started_at"),
-        "location_history": booking.get("location_history", [])[-20:]  # Last 20 points
+        "location_history": await load_route(booking_id, last=20)  # Last 20 points
+    }
+
+@api_router.websocket("/bookings/{booking_id}/live")
+async def live_location_socket(websocket: WebSocket, booking_id: str, token: str = Query(...)):
+    """Push channel replacing live-location polling: a snapshot on connect,
+    then every ingested fix and status change for the booking"""
+    try:
+        claims = await decode_token_claims(token)
+        booking = await get_tracked_booking(booking_id, claims)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    
+    await websocket.accept()
+    subscriber = location_hub.subscribe(booking_id)
+    
+    async def wait_for_disconnect():
+        # Clients don't send anything meaningful; reading just notices the close
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+    
+    receiver = asyncio.create_task(wait_for_disconnect())
+    try:
+        await websocket.send_json({
+            "type": "snapshot",
+            "booking_id": booking_id,
+            "status": booking.get("status"),
+            "gps_tracking_enabled": booking.get("gps_tracking_enabled", False),
+            "current_location": booking.get("walker_current_location"),
+            "started_at": booking.get("started_at"),
+            "safety_flags": booking.get("safety_flags") or {},
+            "location_history": await load_route(booking_id, last=20)
+        })
+        while True:
+            getter = asyncio.create_task(subscriber.get())
+            done, _ = await asyncio.wait(
+                {getter, receiver},
+                timeout=LIVE_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if receiver in done:
+                getter.cancel()
+                break
+            if getter in done:
+                await websocket.send_json(getter.result())
+            else:
+                getter.cancel()
+                await websocket.send_json({"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        location_hub.unsubscribe(booking_id, subscriber)
+
+@api_router.get("/bookings/{booking_id}/route")
+async def get_walk_route(
+    booking_id: str,
+    encoding: str = "points",
+    tolerance_m: float = Query(0.0, ge=0, le=1000),
+    timestamps: bool = False,
+    claims: dict = Depends(get_token_claims)
+):
+    """Full GPS trail of a walk, optionally simplified (Douglas–Peucker at
+    tolerance_m meters) and returned as an encoded polyline"""
+    if encoding not in ["points", "polyline"]:
+        raise HTTPException(status_code=400, detail="encoding debe ser 'points' o 'polyline'")
+    
+    booking = await get_tracked_booking(booking_id, claims)
+    
+    cache_key = (booking_id, encoding, tolerance_m, timestamps)
+    payload = route_cache.get(cache_key) if booking.get("status") == "completed" else None
+    if payload is None:
+        points = await load_route(booking_id)
+        payload = build_route_payload(points, encoding, tolerance_m, timestamps)
+        if booking.get("status") == "completed":
+            route_cache.set(cache_key, payload)
+    
+    return {
+        "booking_id": booking_id,
+        "status": booking.get("status"),
+        "started_at": booking.get("started_at"),
+        "completed_at": booking.get("completed_at"),
+        **payload
     }
 
 @api_router.post("/bookings/{booking_id}/complete")
@@ -3386,7 +5617,7 @@ async def complete_walk(
         raise HTTPException(status_code=404, detail="Reserva no encontrada")
     
     # Verify is the walker
-    walker = await db.walkers.find_one({"user_id": current_user["id"]})
+    walker = await load_provider_profile(current_user)
     if not walker or walker["id"] != booking["service_id"]:
         if current_user.get("role") != "admin":
             raise HTTPException(status_code=403, detail="Solo el paseador puede completar el paseo")
@@ -3394,24 +5625,20 @@ async def complete_walk(
     if booking.get("status") != "in_progress":
         raise HTTPException(status_code=400, detail="El paseo no está en progreso")
     
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {
-            "status": "completed",
-            "completed_at": datetime.now(timezone.utc).isoformat(),
-            "gps_tracking_enabled": False
-        }}
-    )
+    await apply_booking_update(booking_id, {
+        "status": "completed",
+        "completed_at": datetime.now(timezone.utc).isoformat(),
+        "gps_tracking_enabled": False
+    })
     
     # Notify owner
-    notification = Notification(
-        user_id=booking["owner_id"],
+    await dispatch_notification(
+        users=[booking["owner_id"]],
         type="walk_completed",
         title="¡Paseo Completado!",
         message="El paseador ha finalizado el paseo. ¡No olvides calificar el servicio!",
         data={"booking_id": booking_id}
     )
-    await db.notifications.insert_one(notification.model_dump())
     
     return {
         "success": True,
@@ -3466,14 +5693,13 @@ async def create_manual_payment(
     await db.manual_payments.insert_one(manual_payment.model_dump())
     
     # Create notification for admin
-    admin_notification = Notification(
-        user_id="admin",
+    await dispatch_notification(
+        roles=["admin"],
         type="manual_payment",
         title="Nuevo Pago Manual",
         message=f"El usuario {current_user['name']} ha subido un comprobante de pago por ${payment.amount:,.0f}",
         data={"payment_id": manual_payment.id, "booking_id": payment.booking_id}
     )
-    await db.notifications.insert_one(admin_notification.model_dump())
     
     return {"message": "Comprobante enviado para revisión", "payment_id": manual_payment.id}
 
@@ -3519,14 +5745,13 @@ async def register_manual_payment(
     )
     
     # Create notification for admin
-    admin_notification = Notification(
-        user_id="admin",
+    await dispatch_notification(
+        roles=["admin"],
         type="manual_payment",
         title="Nuevo Pago Manual",
         message=f"El usuario {current_user['name']} ha subido un comprobante de pago por ${payment.amount:,.0f}",
         data={"payment_id": manual_payment.id, "booking_id": payment.booking_id}
     )
-    await db.notifications.insert_one(admin_notification.model_dump())
     
     return {"message": "Comprobante enviado para revisión", "payment_id": manual_payment.id}
 
@@ -3584,7 +5809,7 @@ async def seed_admin_user(secret_key: str):
         return {"message": "Admin ya existe", "email": existing["email"]}
     
     admin_email = "admin@pettrust.co"
-    admin_password = hash_password("PetTrust2025!")
+    admin_password = await password_service.hash("PetTrust2025!")
     
     admin_user = {
         "id": str(uuid.uuid4()),
@@ -3597,6 +5822,7 @@ async def seed_admin_user(secret_key: str):
     admin_user["password"] = admin_password
     
     await db.users.insert_one(admin_user)
+    invalidate_cached_user(admin_user["id"])
     return {"message": "Admin creado exitosamente", "email": admin_email}
 
 app.add_middleware(
@@ -3605,11 +5831,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.on_event("startup")
+async def start_write_behind():
+    write_behind.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await write_behind.close()
     client.close()
+    password_service.shutdown()
 
 app.include_router(api_router)
 
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext, useRef } from 'react';
 import axios from 'axios';
 import { API, AuthContext } from '../App';
+import { useChatSocket } from '../hooks/use-chat-socket';
 import { toast } from 'sonner';
 import { Button } from './ui/button';
 import { Input } from './ui/input';
@@ -8,7 +9,7 @@ import { Badge } from './ui/badge';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from './ui/dialog';
 import { 
   MessageCircle, Send, ArrowLeft, User, Loader2, 
-  CheckCheck, Clock 
+  Check, CheckCheck, Clock 
 } from 'lucide-react';
 
 const ChatCenter = ({ isOpen, onClose }) => {
@@ -19,6 +20,9 @@ const ChatCenter = ({ isOpen, onClose }) => {
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(true);
   const [sending, setSending] = useState(false);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const newestCursorRef = useRef(null);
   const messagesEndRef = useRef(null);
 
   useEffect(() => {
@@ -27,19 +31,56 @@ const ChatCenter = ({ isOpen, onClose }) => {
     }
   }, [isOpen]);
 
+  const selectedConversationId = selectedConversation?.id;
+
+  const isMyMessage = (message) => {
+    if (user?.role === 'owner') {
+      return message.sender_role === 'owner';
+    }
+    return message.sender_role !== 'owner';
+  };
+
+  const { connected, send, setLastMessageId } = useChatSocket(selectedConversationId, {
+    onMessage: (message) => {
+      setMessages((prev) => (prev.some((m) => m.id === message.id) ? prev : [...prev, message]));
+      if (!isMyMessage(message)) {
+        // The conversation is open, so the message is seen as soon as it lands
+        send({ type: 'delivered', message_ids: [message.id] });
+        send({ type: 'read' });
+      }
+    },
+    onReceipt: (receipt) => {
+      const myRole = user?.role === 'owner' ? 'owner' : 'provider';
+      if (receipt.reader === myRole) return;
+      setMessages((prev) => prev.map((m) => {
+        if (!isMyMessage(m)) return m;
+        if (receipt.kind === 'read') return { ...m, read: true };
+        return receipt.message_ids.includes(m.id) ? { ...m, delivered_at: receipt.at } : m;
+      }));
+    }
+  });
+
+  useEffect(() => {
+    if (selectedConversationId) {
+      fetchMessages(selectedConversationId);
+    }
+  }, [selectedConversationId]);
+
+  // Polling only while the chat socket is down
   useEffect(() => {
-    if (selectedConversation) {
-      fetchMessages(selectedConversation.id);
+    if (selectedConversationId && !connected) {
       const interval = setInterval(() => {
-        fetchMessages(selectedConversation.id);
+        fetchNewMessages(selectedConversationId);
       }, 5000);
       return () => clearInterval(interval);
     }
-  }, [selectedConversation]);
+  }, [selectedConversationId, connected]);
 
+  // Follow new messages, but not when older history is prepended
+  const lastMessageId = messages.length ? messages[messages.length - 1].id : null;
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [lastMessageId]);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -60,24 +101,70 @@ const ChatCenter = ({ isOpen, onClose }) => {
   const fetchMessages = async (conversationId) => {
     try {
       const response = await axios.get(`${API}/conversations/${conversationId}`);
-      setMessages(response.data.messages);
+      const loaded = response.data.messages;
+      setMessages(loaded);
+      setSelectedConversation(response.data.conversation);
+      setOlderCursor(response.data.has_more ? response.data.before_cursor : null);
+      newestCursorRef.current = response.data.after_cursor;
+      if (loaded.length) setLastMessageId(loaded[loaded.length - 1].id);
+    } catch (error) {
+      console.error('Error fetching messages:', error);
+    }
+  };
+
+  const fetchNewMessages = async (conversationId) => {
+    if (!newestCursorRef.current) {
+      await fetchMessages(conversationId);
+      return;
+    }
+    try {
+      const response = await axios.get(`${API}/conversations/${conversationId}`, {
+        params: { after: newestCursorRef.current }
+      });
+      const loaded = response.data.messages;
+      newestCursorRef.current = response.data.after_cursor;
       setSelectedConversation(response.data.conversation);
+      if (loaded.length) {
+        setMessages((prev) => [...prev, ...loaded.filter((m) => !prev.some((p) => p.id === m.id))]);
+        setLastMessageId(loaded[loaded.length - 1].id);
+      }
     } catch (error) {
       console.error('Error fetching messages:', error);
     }
   };
 
+  const fetchOlderMessages = async () => {
+    if (!olderCursor || !selectedConversation) return;
+    setLoadingOlder(true);
+    try {
+      const response = await axios.get(`${API}/conversations/${selectedConversation.id}`, {
+        params: { before: olderCursor }
+      });
+      setMessages((prev) => [...response.data.messages, ...prev]);
+      setOlderCursor(response.data.has_more ? response.data.before_cursor : null);
+    } catch (error) {
+      console.error('Error fetching messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleSendMessage = async (e) => {
     e.preventDefault();
     if (!newMessage.trim() || !selectedConversation) return;
 
+    if (send({ type: 'send', content: newMessage })) {
+      setNewMessage('');
+      return;
+    }
+
     setSending(true);
     try {
       await axios.post(`${API}/conversations/${selectedConversation.id}/messages`, {
         content: newMessage
       });
       setNewMessage('');
-      await fetchMessages(selectedConversation.id);
+      await fetchNewMessages(selectedConversation.id);
     } catch (error) {
       toast.error('Error al enviar mensaje');
     } finally {
@@ -88,6 +175,8 @@ const ChatCenter = ({ isOpen, onClose }) => {
   const handleBack = () => {
     setSelectedConversation(null);
     setMessages([]);
+    setOlderCursor(null);
+    newestCursorRef.current = null;
     fetchConversations();
   };
 
@@ -110,13 +199,6 @@ const ChatCenter = ({ isOpen, onClose }) => {
     return date.toLocaleDateString('es-CO', { day: 'numeric', month: 'short' });
   };
 
-  const isMyMessage = (message) => {
-    if (user?.role === 'owner') {
-      return message.sender_role === 'owner';
-    }
-    return message.sender_role !== 'owner';
-  };
-
   const getUnreadCount = (conversation) => {
     if (user?.role === 'owner') {
       return conversation.owner_unread || 0;
@@ -172,6 +254,19 @@ const ChatCenter = ({ isOpen, onClose }) => {
             /* Messages View */
             <div className="flex flex-col h-full">
               <div className="flex-1 overflow-y-auto p-4 space-y-3 bg-stone-50">
+                {olderCursor && (
+                  <div className="text-center">
+                    <Button
+                      onClick={fetchOlderMessages}
+                      variant="ghost"
+                      size="sm"
+                      disabled={loadingOlder}
+                      className="text-xs text-stone-500"
+                    >
+                      {loadingOlder ? <Loader2 className="w-4 h-4 animate-spin" /> : 'Cargar mensajes anteriores'}
+                    </Button>
+                  </div>
+                )}
                 {messages.length === 0 ? (
                   <div className="text-center py-8">
                     <MessageCircle className="w-12 h-12 text-stone-300 mx-auto mb-3" />
@@ -208,7 +303,9 @@ const ChatCenter = ({ isOpen, onClose }) => {
                               {isMine && (
                                 message.read 
                                   ? <CheckCheck className="w-3 h-3" />
-                                  : <Clock className="w-3 h-3" />
+                                  : message.delivered_at
+                                    ? <Check className="w-3 h-3" />
+                                    : <Clock className="w-3 h-3" />
                               )}
                             </div>
                           </div>
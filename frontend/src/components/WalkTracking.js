@@ -1,6 +1,7 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import { API } from '../App';
+import { useLiveLocation } from '../hooks/use-live-location';
 import { toast } from 'sonner';
 import { Card, CardContent, CardHeader, CardTitle } from './ui/card';
 import { Button } from './ui/button';
@@ -229,26 +230,40 @@ export const PinVerifier = ({ booking, onVerified }) => {
     );
 };
 
+// Walker fixes are buffered and uploaded in batches
+const GPS_FLUSH_INTERVAL_MS = 5000;
+const GPS_MAX_BUFFERED_FIXES = 500;
+
 // Live GPS Tracker Component
 export const LiveGpsTracker = ({ booking, isWalker = false }) => {
-    const [location, setLocation] = useState(null);
-    const [loading, setLoading] = useState(true);
+    const [walkerLocation, setLocation] = useState(null);
     const [watchId, setWatchId] = useState(null);
-
-    // Fetch location from server
-    const fetchLocation = useCallback(async () => {
+    const pendingFixes = useRef([]);
+    const flushing = useRef(false);
+
+    // Owner receives pushed updates for the walk
+    const liveLocation = useLiveLocation(booking.id, !isWalker && booking.status === 'in_progress');
+    const location = isWalker ? walkerLocation : liveLocation;
+    const loading = !isWalker && liveLocation === null;
+
+    // Upload buffered fixes (for walker); on failure they stay queued for the next flush
+    const flushLocations = useCallback(async () => {
+        if (flushing.current || pendingFixes.current.length === 0) return;
+        flushing.current = true;
+        const batch = pendingFixes.current;
+        pendingFixes.current = [];
         try {
-            const response = await axios.get(`${API}/bookings/${booking.id}/live-location`);
-            setLocation(response.data);
+            await axios.post(`${API}/bookings/${booking.id}/locations`, { fixes: batch });
         } catch (error) {
-            console.error('Error fetching location:', error);
+            console.error('Error updating location:', error);
+            pendingFixes.current = batch.concat(pendingFixes.current).slice(-GPS_MAX_BUFFERED_FIXES);
         } finally {
-            setLoading(false);
+            flushing.current = false;
         }
     }, [booking.id]);
 
-    // Send location to server (for walker)
-    const sendLocation = useCallback(async (position) => {
+    // Buffer a GPS fix (for walker)
+    const sendLocation = useCallback((position) => {
         const newLocation = {
             lat: position.coords.latitude,
             lng: position.coords.longitude
@@ -257,17 +272,28 @@ export const LiveGpsTracker = ({ booking, isWalker = false }) => {
         // Update local state immediately for the walker UI
         setLocation({ current_location: newLocation });
 
-        try {
-            await axios.post(`${API}/bookings/${booking.id}/update-location`, {
-                lat: position.coords.latitude,
-                lng: position.coords.longitude,
-                accuracy: position.coords.accuracy,
-                speed: position.coords.speed
-            });
-        } catch (error) {
-            console.error('Error updating location:', error);
+        pendingFixes.current.push({
+            lat: position.coords.latitude,
+            lng: position.coords.longitude,
+            accuracy: position.coords.accuracy,
+            speed: position.coords.speed,
+            timestamp: new Date(position.timestamp).toISOString()
+        });
+        if (pendingFixes.current.length > GPS_MAX_BUFFERED_FIXES) {
+            pendingFixes.current.shift();
         }
-    }, [booking.id]);
+    }, []);
+
+    // Flush buffered fixes periodically while the walk is active
+    useEffect(() => {
+        if (isWalker && booking.status === 'in_progress') {
+            const interval = setInterval(flushLocations, GPS_FLUSH_INTERVAL_MS);
+            return () => {
+                clearInterval(interval);
+                flushLocations();
+            };
+        }
+    }, [isWalker, booking.status, flushLocations]);
 
     // Start GPS tracking for walker
     useEffect(() => {
@@ -290,15 +316,6 @@ export const LiveGpsTracker = ({ booking, isWalker = false }) => {
         };
     }, [isWalker, booking.status, sendLocation]);
 
-    // Poll location for owner
-    useEffect(() => {
-        if (!isWalker && booking.status === 'in_progress') {
-            fetchLocation();
-            const interval = setInterval(fetchLocation, 10000); // Poll every 10 seconds
-            return () => clearInterval(interval);
-        }
-    }, [isWalker, booking.status, fetchLocation]);
-
     if (booking.status !== 'in_progress') {
         return null;
     }
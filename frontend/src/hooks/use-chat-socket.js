@@ -0,0 +1,105 @@
+import { useState, useEffect, useRef, useCallback } from 'react';
+import { API } from '../App';
+
+const RECONNECT_DELAY_MS = 5000;
+
+// Chat gateway connection for one conversation. Pushes messages and
+// receipts to the handlers, and on reconnect resumes from the last
+// message id seen so nothing posted while disconnected is missed.
+// `connected` is false while the socket is down so callers can poll.
+export function useChatSocket(conversationId, handlers) {
+  const [connected, setConnected] = useState(false);
+  const socketRef = useRef(null);
+  const handlersRef = useRef(handlers);
+  const lastMessageIdRef = useRef(null);
+
+  handlersRef.current = handlers;
+
+  useEffect(() => {
+    if (!conversationId) return;
+
+    let reconnectTimer = null;
+    let closed = false;
+    lastMessageIdRef.current = null;
+
+    const handleMessage = (event) => {
+      const message = JSON.parse(event.data);
+      const { onMessage, onReceipt, onAck, onError } = handlersRef.current;
+      if (message.type === 'message') {
+        lastMessageIdRef.current = message.message.id;
+        onMessage?.(message.message);
+      } else if (message.type === 'resume') {
+        message.messages.forEach((m) => {
+          lastMessageIdRef.current = m.id;
+          onMessage?.(m);
+        });
+        if (message.has_more) {
+          socketRef.current?.send(JSON.stringify({
+            type: 'resume',
+            conversation_id: conversationId,
+            after: message.after_cursor
+          }));
+        }
+      } else if (message.type === 'receipt') {
+        onReceipt?.(message);
+      } else if (message.type === 'ack') {
+        onAck?.(message);
+      } else if (message.type === 'error') {
+        if (message.request === 'subscribe' && message.status === 404 && lastMessageIdRef.current) {
+          // Resume point no longer known to the server: subscribe without it
+          lastMessageIdRef.current = null;
+          socketRef.current?.send(JSON.stringify({ type: 'subscribe', conversation_id: conversationId }));
+        }
+        onError?.(message);
+      }
+    };
+
+    const connect = () => {
+      const token = localStorage.getItem('token');
+      if (!token || typeof WebSocket === 'undefined') return;
+
+      const socket = new WebSocket(
+        `${API.replace(/^http/, 'ws')}/chat/ws?token=${encodeURIComponent(token)}`
+      );
+      socketRef.current = socket;
+      socket.onopen = () => {
+        socket.send(JSON.stringify({
+          type: 'subscribe',
+          conversation_id: conversationId,
+          last_message_id: lastMessageIdRef.current
+        }));
+        setConnected(true);
+      };
+      socket.onmessage = handleMessage;
+      socket.onclose = () => {
+        setConnected(false);
+        if (closed) return;
+        reconnectTimer = setTimeout(connect, RECONNECT_DELAY_MS);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      if (socketRef.current) socketRef.current.close();
+      socketRef.current = null;
+      setConnected(false);
+    };
+  }, [conversationId]);
+
+  // Remembers the newest message loaded over HTTP as the resume point
+  const setLastMessageId = useCallback((messageId) => {
+    lastMessageIdRef.current = messageId;
+  }, []);
+
+  const send = useCallback((command) => {
+    const socket = socketRef.current;
+    if (!socket || socket.readyState !== WebSocket.OPEN) return false;
+    socket.send(JSON.stringify({ conversation_id: conversationId, ...command }));
+    return true;
+  }, [conversationId]);
+
+  return { connected, send, setLastMessageId };
+}
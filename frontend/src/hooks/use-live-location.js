@@ -0,0 +1,112 @@
+import { useState, useEffect, useRef } from 'react';
+import axios from 'axios';
+import { API } from '../App';
+
+const POLL_INTERVAL_MS = 10000;
+const RECONNECT_DELAY_MS = 15000;
+const MAX_TRAIL_POINTS = 20;
+
+// Safety event type -> [flag on booking.safety_flags, active]
+const SAFETY_FLAG_EVENTS = {
+  left_service_area: ['outside_service_area', true],
+  returned_to_service_area: ['outside_service_area', false],
+  stationary: ['stationary', true],
+  moving_again: ['stationary', false],
+  impossible_jump: ['gps_jump', true],
+  gps_stable: ['gps_jump', false]
+};
+
+// Live walk location for a booking, pushed over a WebSocket, including
+// safety_flags kept current from pushed safety events.
+// Falls back to polling /live-location while the socket is down.
+export function useLiveLocation(bookingId, enabled) {
+  const [liveLocation, setLiveLocation] = useState(null);
+  const socketRef = useRef(null);
+
+  useEffect(() => {
+    if (!enabled || !bookingId) return;
+
+    let pollTimer = null;
+    let reconnectTimer = null;
+    let closed = false;
+
+    const fetchLiveLocation = async () => {
+      try {
+        const response = await axios.get(`${API}/bookings/${bookingId}/live-location`);
+        setLiveLocation(response.data);
+      } catch (error) {
+        console.error('Error fetching location:', error);
+      }
+    };
+
+    const startPolling = () => {
+      if (pollTimer) return;
+      fetchLiveLocation();
+      pollTimer = setInterval(fetchLiveLocation, POLL_INTERVAL_MS);
+    };
+
+    const stopPolling = () => {
+      clearInterval(pollTimer);
+      pollTimer = null;
+    };
+
+    const handleMessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'snapshot') {
+        const { type, ...snapshot } = message;
+        setLiveLocation(snapshot);
+      } else if (message.type === 'location') {
+        setLiveLocation((prev) => ({
+          ...prev,
+          current_location: message.current_location,
+          location_history: [...(prev?.location_history || []), ...message.points].slice(-MAX_TRAIL_POINTS)
+        }));
+      } else if (message.type === 'status') {
+        setLiveLocation((prev) => ({ ...prev, status: message.status }));
+      } else if (message.type === 'safety') {
+        const mapping = SAFETY_FLAG_EVENTS[message.event];
+        if (!mapping) return;
+        const [flag, active] = mapping;
+        setLiveLocation((prev) => ({
+          ...prev,
+          safety_flags: {
+            ...(prev?.safety_flags || {}),
+            [flag]: { active, updated_at: message.ts, lat: message.lat, lng: message.lng }
+          }
+        }));
+      }
+    };
+
+    const connect = () => {
+      const token = localStorage.getItem('token');
+      if (!token || typeof WebSocket === 'undefined') {
+        startPolling();
+        return;
+      }
+
+      const socket = new WebSocket(
+        `${API.replace(/^http/, 'ws')}/bookings/${bookingId}/live?token=${encodeURIComponent(token)}`
+      );
+      socketRef.current = socket;
+      socket.onopen = stopPolling;
+      socket.onmessage = handleMessage;
+      socket.onclose = () => {
+        if (closed) return;
+        startPolling();
+        reconnectTimer = setTimeout(connect, RECONNECT_DELAY_MS);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      stopPolling();
+      clearTimeout(reconnectTimer);
+      if (socketRef.current) socketRef.current.close();
+      socketRef.current = null;
+    };
+  }, [bookingId, enabled]);
+
+  return liveLocation;
+}
@@ -15,6 +15,7 @@ import { MapContainer, TileLayer, Marker, Popup, useMap } from 'react-leaflet';
 import L from 'leaflet';
 import 'leaflet/dist/leaflet.css';
 import { PinGenerator, LiveGpsTracker } from '../components/WalkTracking';
+import { useLiveLocation } from '../hooks/use-live-location';
 
 // Fix Leaflet default icon
 delete L.Icon.Default.prototype._getIconUrl;
@@ -38,7 +39,6 @@ const Tracking = () => {
   const navigate = useNavigate();
   const { user } = useContext(AuthContext);
   const [booking, setBooking] = useState(null);
-  const [liveLocation, setLiveLocation] = useState(null);
   const [loading, setLoading] = useState(true);
   const [refreshing, setRefreshing] = useState(false);
 
@@ -55,29 +55,13 @@ const Tracking = () => {
     }
   }, [bookingId]);
 
-  const fetchLiveLocation = useCallback(async () => {
-    if (!booking || booking.status !== 'in_progress') return;
-
-    try {
-      const response = await axios.get(`${API}/bookings/${bookingId}/live-location`);
-      setLiveLocation(response.data);
-    } catch (error) {
-      console.error('Error fetching location:', error);
-    }
-  }, [bookingId, booking]);
+  // Pushed over a WebSocket while the walk is in progress
+  const liveLocation = useLiveLocation(bookingId, booking?.status === 'in_progress');
 
   useEffect(() => {
     fetchBooking();
   }, [fetchBooking]);
 
-  useEffect(() => {
-    if (booking?.status === 'in_progress') {
-      fetchLiveLocation();
-      const interval = setInterval(fetchLiveLocation, 10000); // Poll every 10s
-      return () => clearInterval(interval);
-    }
-  }, [booking?.status, fetchLiveLocation]);
-
   // Auto-refresh booking status
   useEffect(() => {
     const interval = setInterval(fetchBooking, 30000);
@@ -87,7 +71,6 @@ const Tracking = () => {
   const handleRefresh = () => {
     setRefreshing(true);
     fetchBooking();
-    fetchLiveLocation();
   };
 
   const getStatusInfo = (status) => {
@@ -126,6 +109,11 @@ const Tracking = () => {
   const statusInfo = getStatusInfo(booking.status);
   const StatusIcon = statusInfo.icon;
   const currentLocation = liveLocation?.current_location || booking.walker_current_location;
+  const safetyFlags = liveLocation?.safety_flags || {};
+  const safetyWarnings = [
+    safetyFlags.outside_service_area?.active && 'El paseador salió del área de servicio.',
+    safetyFlags.stationary?.active && 'El paseador lleva más de 15 minutos sin moverse.'
+  ].filter(Boolean);
 
   return (
     <div className="min-h-screen bg-gradient-to-b from-stone-50 to-white">
@@ -159,6 +147,15 @@ const Tracking = () => {
           </Button>
         </div>
 
+        {booking.status === 'in_progress' && safetyWarnings.length > 0 && (
+          <div className="mb-6 rounded-2xl border border-amber-200 bg-amber-50 p-4 flex items-start gap-3" data-testid="safety-warning">
+            <AlertCircle className="w-5 h-5 text-amber-600 mt-0.5" />
+            <div className="text-sm text-amber-800">
+              {safetyWarnings.map((warning) => <p key={warning}>{warning}</p>)}
+            </div>
+          </div>
+        )}
+
         <div className="grid lg:grid-cols-3 gap-6">
           {/* Main Map Section */}
           <div className="lg:col-span-2">
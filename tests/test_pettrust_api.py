@@ -6,6 +6,8 @@ import pytest
 import requests
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://pettrust-bogota.preview.emergentagent.com')
 
@@ -84,6 +86,44 @@ class TestAuthentication:
         assert response.status_code == 200
         data = response.json()
         assert data["email"] == TEST_OWNER["email"]
+        assert "password" not in data
+    
+    def test_revoke_sessions(self):
+        """Test revoked tokens are rejected on write endpoints"""
+        unique_email = f"TEST_user_{uuid.uuid4().hex[:8]}@test.com"
+        old_token = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": unique_email,
+            "password": "testpass123",
+            "name": "Revoke User",
+            "role": "owner"
+        }).json()["token"]
+        
+        response = requests.post(
+            f"{BASE_URL}/api/auth/revoke-sessions",
+            headers={"Authorization": f"Bearer {old_token}"}
+        )
+        assert response.status_code == 200
+        new_token = response.json()["token"]
+        
+        old_me = requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {old_token}"})
+        assert old_me.status_code == 401
+        new_me = requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {new_token}"})
+        assert new_me.status_code == 200
+    
+    def test_admin_metrics_user_cache(self):
+        """Test user cache counters exposed to admins"""
+        token = requests.post(f"{BASE_URL}/api/auth/login", json=ADMIN).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        # Second lookup of the same user must be served from the cache
+        requests.get(f"{BASE_URL}/api/auth/me", headers=headers)
+        requests.get(f"{BASE_URL}/api/auth/me", headers=headers)
+        
+        response = requests.get(f"{BASE_URL}/api/admin/metrics", headers=headers)
+        assert response.status_code == 200
+        stats = response.json()["user_cache"]
+        assert stats["hits"] >= 1
+        assert stats["size"] <= stats["max_size"]
 
 
 class TestWalkers:
@@ -292,6 +332,28 @@ class TestProviderSearch:
             data = response.json()
             assert "available" in data
             assert "capacity_remaining" in data
+    
+    def test_provider_slots_calendar(self):
+        """Test day x slot occupancy grid for a date range"""
+        walkers_response = requests.get(f"{BASE_URL}/api/walkers")
+        walkers = walkers_response.json()
+        
+        if walkers:
+            response = requests.get(
+                f"{BASE_URL}/api/providers/walker/{walkers[0]['id']}/slots",
+                params={"from": "2026-01-20", "to": "2026-01-26"}
+            )
+            assert response.status_code == 200
+            data = response.json()
+            assert len(data["days"]) == 7
+            assert data["days"][0]["date"] == "2026-01-20"
+            assert "slots" in data["days"][0]
+            
+            too_long = requests.get(
+                f"{BASE_URL}/api/providers/walker/{walkers[0]['id']}/slots",
+                params={"from": "2026-01-01", "to": "2026-03-01"}
+            )
+            assert too_long.status_code == 400
 
 
 class TestServiceRequests:
@@ -389,6 +451,33 @@ class TestProviderInbox:
         assert response.status_code == 200
         data = response.json()
         assert "bookings" in data
+    
+    def test_concurrent_accepts_claim_once(self, walker_token):
+        """Test 50 simultaneous accepts of one request produce exactly one booking"""
+        inbox = requests.get(
+            f"{BASE_URL}/api/providers/me/inbox",
+            headers={"Authorization": f"Bearer {walker_token}"}
+        ).json()
+        pending = [item for item in inbox if not item.get("is_expired")]
+        if not pending:
+            pytest.skip("No pending requests in walker inbox")
+        
+        def accept(_):
+            return requests.post(
+                f"{BASE_URL}/api/providers/me/inbox/{pending[0]['id']}/respond",
+                params={"action": "accept"},
+                headers={"Authorization": f"Bearer {walker_token}"}
+            )
+        
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            responses = list(executor.map(accept, range(50)))
+        
+        status_codes = [r.status_code for r in responses]
+        assert status_codes.count(200) <= 1
+        assert all(code in (200, 409, 410) for code in status_codes)
+        if 200 in status_codes:
+            booking_ids = {r.json()["booking_id"] for r in responses if r.status_code == 200}
+            assert len(booking_ids) == 1
 
 
 class TestWompiPayments:
@@ -574,6 +663,113 @@ class TestSafetyCenter:
             data = response.json()
             assert "share_code" in data
             assert "share_url" in data
+    
+    def test_shared_trip_conditional_get(self, owner_token):
+        """Test shared trip hides the PIN and answers 304 to a matching ETag"""
+        bookings = requests.get(
+            f"{BASE_URL}/api/bookings",
+            headers={"Authorization": f"Bearer {owner_token}"}
+        ).json()
+        if not bookings:
+            pytest.skip("Owner has no bookings")
+        
+        link = requests.post(
+            f"{BASE_URL}/api/bookings/{bookings[0]['id']}/share-trip",
+            headers={"Authorization": f"Bearer {owner_token}"}
+        ).json()
+        
+        response = requests.get(f"{BASE_URL}/api/track/{link['share_code']}")
+        assert response.status_code == 200
+        assert "verification_pin" not in response.json()["booking"]
+        etag = response.headers.get("ETag")
+        assert etag
+        
+        cached = requests.get(
+            f"{BASE_URL}/api/track/{link['share_code']}",
+            headers={"If-None-Match": etag}
+        )
+        assert cached.status_code in (200, 304)
+        if cached.status_code == 304:
+            assert cached.content == b""
+
+    def test_accepted_request_geofence_exit(self, owner_token):
+        """Test a walk booked from a service request flags leaving the pickup area"""
+        walker_token = requests.post(f"{BASE_URL}/api/auth/login", json=TEST_WALKER).json()["token"]
+        owner_headers = {"Authorization": f"Bearer {owner_token}"}
+        walker_headers = {"Authorization": f"Bearer {walker_token}"}
+
+        pets = requests.get(f"{BASE_URL}/api/pets", headers=owner_headers).json()
+        if not pets:
+            pytest.skip("Owner has no pets")
+
+        pickup = {"lat": 4.6951, "lng": -74.0621}
+        created = requests.post(
+            f"{BASE_URL}/api/service-requests",
+            json={
+                "pet_id": pets[0]["id"],
+                "service_type": "walker",
+                "date": "2026-02-14",
+                "time": f"{uuid.uuid4().int % 12 + 6:02d}:00",
+                "pickup_lat": pickup["lat"],
+                "pickup_lng": pickup["lng"],
+                "owner_lat": pickup["lat"],
+                "owner_lng": pickup["lng"]
+            },
+            headers=owner_headers
+        ).json()
+
+        inbox = requests.get(f"{BASE_URL}/api/providers/me/inbox", headers=walker_headers).json()
+        item = next((i for i in inbox if i["request_id"] == created["request_id"]), None)
+        if not item:
+            pytest.skip("Test walker was not matched to the request")
+
+        accepted = requests.post(
+            f"{BASE_URL}/api/providers/me/inbox/{item['id']}/respond",
+            params={"action": "accept"},
+            headers=walker_headers
+        )
+        if accepted.status_code == 409:
+            pytest.skip("Test walker has no capacity in this slot")
+        assert accepted.status_code == 200
+        booking = accepted.json()["booking"]
+        assert booking["pickup_coordinates"] == pickup
+
+        requests.post(
+            f"{BASE_URL}/api/bookings/{booking['id']}/payment",
+            params={"payment_id": f"TEST_{uuid.uuid4().hex[:8]}"},
+            headers=owner_headers
+        )
+        pin = requests.post(f"{BASE_URL}/api/bookings/{booking['id']}/generate-pin", headers=owner_headers).json()["pin"]
+        verified = requests.post(
+            f"{BASE_URL}/api/bookings/{booking['id']}/verify-pin",
+            params={"pin": pin},
+            headers=walker_headers
+        )
+        assert verified.json()["success"]
+
+        # Walk north at ~3 m/s until well past any walker's radius
+        start = datetime.now(timezone.utc) - timedelta(hours=2)
+        fixes = [
+            {
+                "lat": pickup["lat"] + i * 0.0027,
+                "lng": pickup["lng"],
+                "accuracy": 5,
+                "timestamp": (start + timedelta(seconds=100 * i)).isoformat()
+            }
+            for i in range(60)
+        ]
+        uploaded = requests.post(
+            f"{BASE_URL}/api/bookings/{booking['id']}/locations",
+            json={"fixes": fixes},
+            headers=walker_headers
+        )
+        assert uploaded.status_code == 200
+
+        status = requests.get(
+            f"{BASE_URL}/api/bookings/{booking['id']}/safety-status",
+            headers=owner_headers
+        ).json()
+        assert status["safety_flags"]["outside_service_area"]["active"] is True
 
 
 class TestReviews:
@@ -0,0 +1,163 @@
+"""
+WriteBehindBuffer unit tests
+Runs against an in-memory collection, no server or MongoDB needed
+"""
+import asyncio
+import os
+import sys
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "pettrust_test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import server  # noqa: E402
+
+
+class FakeCollection:
+    """insert_many stand-in; `failures` is a list of callables, one per call,
+    that may store documents and raise before the normal insert runs"""
+
+    def __init__(self, failures=None, on_insert=None):
+        self.docs = {}
+        self.calls = 0
+        self.failures = list(failures or [])
+        self.on_insert = on_insert
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.on_insert:
+            await self.on_insert(docs)
+        if self.failures:
+            self.failures.pop(0)(self, docs)
+        duplicates = [index for index, doc in enumerate(docs) if doc["id"] in self.docs]
+        for doc in docs:
+            self.docs.setdefault(doc["id"], doc)
+        if duplicates:
+            raise BulkWriteError({
+                "writeErrors": [{"index": index, "code": 11000} for index in duplicates],
+                "writeConcernErrors": [],
+                "nInserted": len(docs) - len(duplicates)
+            })
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def make_buffer(**overrides):
+    options = {"max_docs": 3, "batch_size": 100, "flush_interval": 60, "max_retries": 2}
+    options.update(overrides)
+    buffer = server.WriteBehindBuffer(**options)
+    stored = []
+
+    async def after_insert(docs):
+        stored.extend(doc["id"] for doc in docs)
+
+    buffer.register("notifications", after_insert)
+    return buffer, stored
+
+
+def docs(*ids):
+    return [{"id": doc_id} for doc_id in ids]
+
+
+class TestWriteBehindBuffer:
+    """Queueing, overflow and retry behaviour"""
+
+    def test_overflow_written_inline_and_drained_on_close(self, monkeypatch):
+        """Documents past max_docs are written inline; close() drains the rest"""
+        database = FakeDatabase()
+        monkeypatch.setattr(server, "db", database)
+        buffer, stored = make_buffer()
+
+        async def scenario():
+            buffer.start()
+            await buffer.add("notifications", docs("a", "b"))
+            assert buffer.queued == 2
+            await buffer.add("notifications", docs("c", "d"))
+            assert sorted(database["notifications"].docs) == ["c", "d"]
+            assert buffer.inline == 2
+            await buffer.close()
+
+        asyncio.run(scenario())
+        assert sorted(database["notifications"].docs) == ["a", "b", "c", "d"]
+        assert sorted(stored) == ["a", "b", "c", "d"]
+        assert buffer.queued == 0
+        assert buffer.stats()["written"] == 4
+
+    def test_flush_tolerates_new_collection_while_writing(self, monkeypatch):
+        """A collection queued during a flush is written by the next one"""
+        database = FakeDatabase()
+        monkeypatch.setattr(server, "db", database)
+        buffer, _ = make_buffer(max_docs=100)
+
+        async def queue_event(batch):
+            await buffer.add("safety_events", docs("event-" + batch[0]["id"]))
+
+        database["notifications"] = FakeCollection(on_insert=queue_event)
+
+        async def scenario():
+            buffer.start()
+            await buffer.add("notifications", docs("a"))
+            await buffer.flush()
+            await buffer.close()
+
+        asyncio.run(scenario())
+        assert list(database["safety_events"].docs) == ["event-a"]
+        assert buffer.failed == 0
+
+    def test_retry_after_partial_write_counts_duplicates_as_stored(self, monkeypatch):
+        """A batch stored before a connection error is not stored or counted twice"""
+        def store_then_disconnect(collection, batch):
+            for doc in batch:
+                collection.docs[doc["id"]] = doc
+            raise AutoReconnect("connection reset")
+
+        database = FakeDatabase()
+        database["notifications"] = FakeCollection(failures=[store_then_disconnect])
+        monkeypatch.setattr(server, "db", database)
+        buffer, stored = make_buffer()
+
+        async def scenario():
+            buffer.start()
+            await buffer.add("notifications", docs("a", "b"))
+            await buffer.close()
+
+        asyncio.run(scenario())
+        assert database["notifications"].calls == 2
+        assert sorted(stored) == ["a", "b"]
+        assert buffer.retries == 1
+        assert buffer.failed == 0
+
+    def test_rejected_documents_retried_alone_and_stored_ones_counted(self, monkeypatch):
+        """When some documents keep failing, the rest still reach the hook"""
+        def reject_b(collection, batch):
+            ids = [doc["id"] for doc in batch]
+            for doc in batch:
+                if doc["id"] != "b":
+                    collection.docs[doc["id"]] = doc
+            raise BulkWriteError({
+                "writeErrors": [{"index": ids.index("b"), "code": 121}],
+                "writeConcernErrors": [],
+                "nInserted": len(batch) - 1
+            })
+
+        database = FakeDatabase()
+        database["notifications"] = FakeCollection(failures=[reject_b] * 3)
+        monkeypatch.setattr(server, "db", database)
+        buffer, stored = make_buffer()
+
+        async def scenario():
+            buffer.start()
+            await buffer.add("notifications", docs("a", "b", "c"))
+            await buffer.close()
+
+        asyncio.run(scenario())
+        assert sorted(stored) == ["a", "c"]
+        assert buffer.failed == 1
+        assert buffer.retries == 2